@@ -2,19 +2,46 @@ import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter.font import Font
 import os
-import fnmatch
-import openpyxl
 import tempfile
 import subprocess
 import configparser
 import threading
 import time
-import xlrd
-import csv
-import chardet
+import queue
+import re
+import functools
+
+from excel_searcher import ExcelSearcher, ContentIndex, SearchQuery, ResultCache, ListingCache, ListingRefresher
+from excel_search_server import RemoteSearcher, SearchServerError
+from excel_search_export import open_exporter, TextExporter
 
 DEBUG = False
 
+RESULTS_FLUSH_MS = 100  # Interval at which found matches and the progress are moved into the window
+RESULTS_FLUSH_BUDGET = 0.02  # Seconds the UI thread spends at most per interval taking matches from the queue
+RESULTS_WHEEL_LINES = 3  # Result lines scrolled per mouse wheel step
+RESULT_CACHE_MB = 64  # Memory budget of the results kept per file content across the searches of a session
+LISTING_REFRESH_SECONDS = 300  # Interval at which the file lists of the last searched folder are refreshed while idle
+CLOSE_WAIT_MS = 30000  # Time the application waits at most on closing for a stopped search to finish its exports
+
+# Search mode checkboxes, the names are SearchQuery arguments except multiple_terms
+SEARCH_OPTIONS = [
+    ('multiple_terms', "Several terms (separate with ;)"),
+    ('regex', "Regular expression"),
+    ('whole_cell', "Whole cell"),
+    ('case_sensitive', "Match case"),
+    ('all_rows', "All matching rows"),
+    ('all_sheets', "All sheets"),
+]
+
+# Search order choices, mapped to the ExcelSearcher order argument
+SEARCH_ORDERS = {
+    "As found": None,
+    "Smallest first": 'size',
+    "Newest first": 'mtime',
+    "By path": 'path',
+}
+
 #-----------------------------------------------------------------------------------------------------------------------------
 def shorten_path(path, max_length=None):
     """
@@ -44,14 +71,33 @@ def shorten_path(path, max_length=None):
         i += 1
     return shortened + os.sep + "..." + os.sep + os.sep.join(path_parts[i:])
 
+#-----------------------------------------------------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=None)
+def get_font(font_description):
+    """Return a Font for a widget's font option, created once per font instead of per measurement."""
+    return Font(font=font_description)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=16384)
+def text_length_in_pixels(text, font_description):
+    return get_font(font_description).measure(text)
+
 #-----------------------------------------------------------------------------------------------------------------------------
 def shorten_path_pixels(path, max_pixels=500, widget=None):
-    def text_length_in_pixels(text):
-        font = Font(font=widget.cget("font"))
-        return font.measure(text)
+    """
+    Shortens a path to fit in max_pixels in the font of the widget, by shortening the middle with '...'
+    The font metrics and the shortened paths are cached, the status label shows the same folders over and over.
+    """
+    return _shorten_path_pixels(path, max_pixels, str(widget.cget("font")))
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=1024)
+def _shorten_path_pixels(path, max_pixels, font_description):
+    def text_length(text):
+        return text_length_in_pixels(text, font_description)
 
     path = os.path.normpath(path)
-    if text_length_in_pixels(path) <= max_pixels:
+    if text_length(path) <= max_pixels:
         return path
 
     path_parts = path.split(os.sep)
@@ -59,132 +105,18 @@ def shorten_path_pixels(path, max_pixels=500, widget=None):
     i = 1
     while i < len(path_parts):
         next_part = shortened + os.sep + path_parts[i]
-        if text_length_in_pixels(next_part + os.sep + '...') + text_length_in_pixels(os.sep.join(path_parts[-1:])) > max_pixels / 2:
+        if text_length(next_part + os.sep + '...') + text_length(os.sep.join(path_parts[-1:])) > max_pixels / 2:
             break
         shortened = next_part
         i += 1
 
     trailing = os.sep.join(path_parts[i:])
-    while text_length_in_pixels(shortened + os.sep + '...' + os.sep + trailing) > max_pixels and i < len(path_parts):
+    while text_length(shortened + os.sep + '...' + os.sep + trailing) > max_pixels and i < len(path_parts):
         i += 1
         trailing = os.sep.join(path_parts[i:])
     return shortened + os.sep + '...' + os.sep + trailing
 
 
-#-----------------------------------------------------------------------------------------------------------------------------
-#-----------------------------------------------------------------------------------------------------------------------------
-class ExcelSearcher:
-    def __init__(self, base_folder, recursive=False):
-        self.base_folder = base_folder
-        self.recursive = recursive
-        self.searching = False
-
-    #-----------------------------------------------------------------------------------------------------------------------------
-    def search_excel_files(self, fname_match, progress_callback=None, include_csv=False):
-        found_files = []
-
-        def file_matches(file_name):
-            return (
-                fnmatch.fnmatch(file_name, f'*{fname_match}*.xlsx') or
-                fnmatch.fnmatch(file_name, f'*{fname_match}*.xltx') or
-                fnmatch.fnmatch(file_name, f'*{fname_match}*.xlsm') or
-                fnmatch.fnmatch(file_name, f'*{fname_match}*.xls') or
-                (include_csv and fnmatch.fnmatch(file_name, f'*{fname_match}*.csv'))
-            )
-
-        if self.recursive:
-            for root, _, files in os.walk(self.base_folder):
-                if progress_callback:
-                    progress_callback(root)
-                if not self.searching:
-                    break
-                for file_name in files:
-                    if file_matches(file_name):
-                        found_files.append(os.path.join(root, file_name))
-        else:
-            for subdir in os.listdir(self.base_folder):
-                if not self.searching:
-                    break
-                subdir_path = os.path.join(self.base_folder, subdir)
-                if os.path.isdir(subdir_path):
-                    if progress_callback:
-                        progress_callback(f"Scanning directories {subdir}")
-                    for file_name in os.listdir(subdir_path):
-                        if file_matches(file_name):
-                            found_files.append(os.path.join(subdir_path, file_name))
-        return found_files
-
-    #-----------------------------------------------------------------------------------------------------------------------------
-    def search_excel(self, file_path, search_text):
-        def detect_encoding(file_path):
-            with open(file_path, 'rb') as f:
-                result = chardet.detect(f.read())
-            return result['encoding']
-
-        found_rows = []
-
-        if file_path.lower().endswith(('.xlsx', '.xltx', '.xlsm')):
-            workbook = openpyxl.load_workbook(file_path)
-            sheet = workbook.active
-            for row in sheet.iter_rows():
-                if not self.searching:
-                    break
-                for cell in row:
-                    if cell.value and search_text.lower() in str(cell.value).lower():
-                        found_rows.append([cell.value for cell in row])
-                        return found_rows
-        elif file_path.lower().endswith('.xls'):
-            workbook = xlrd.open_workbook(file_path)
-            sheet = workbook.sheet_by_index(0)
-            for row_idx in range(sheet.nrows):
-                if not self.searching:
-                    break
-                row = sheet.row(row_idx)
-                for cell in row:
-                    cell_value = cell.value
-                    if cell_value and search_text.lower() in str(cell_value).lower():
-                        found_rows.append([cell.value for cell in row])
-                        return found_rows
-        elif file_path.lower().endswith('.csv'):
-            encoding = detect_encoding(file_path)
-            with open(file_path, 'r', newline='', encoding=encoding) as csvfile:
-                csvreader = csv.reader(csvfile, delimiter=';')
-                for row in csvreader:
-                    if not self.searching:
-                        break
-                    for cell in row:
-                        if search_text.lower() in cell.lower():
-                            found_rows.append(row)
-                            return found_rows
-        else:
-            raise ValueError("Unsupported file format")
-
-        return found_rows
-
-    #-----------------------------------------------------------------------------------------------------------------------------
-    def search_excel_files_with_text(self, fname_match, search_text, progress_callback=None, search_results_callback=None, include_csv=False):
-        self.searching = True
-        excel_files = self.search_excel_files(fname_match, progress_callback, include_csv)
-        files_with_text = []
-
-        for file in excel_files:
-            if not self.searching:
-                break
-            progress_callback(str(file))
-            found_rows = self.search_excel(file, search_text)
-            if found_rows:
-                files_with_text.append((file, found_rows))
-                def update_search_results(self, full_path, subdir_name, file_name, found_rows):
-                    search_results_callback(os.path(file), "./", os.path.basename(file), found_rows)
-
-        self.searching = False
-        return files_with_text
-
-    #-----------------------------------------------------------------------------------------------------------------------------
-    def stop_search(self):
-        self.searching = False
-
-
 #-----------------------------------------------------------------------------------------------------------------------------
 #-----------------------------------------------------------------------------------------------------------------------------
 class App:
@@ -196,6 +128,7 @@ class App:
         width_fields = 80
 
         self.searching = False  # Flag to control the search process
+        self.search_thread = None
 
         # Path input
         self.label_path = tk.Label(root, text="Path to search:")
@@ -230,6 +163,29 @@ class App:
         self.var_recursive_search = tk.BooleanVar()
         self.check_recursive_search = tk.Checkbutton(root, text="All subfolders", variable=self.var_recursive_search)
         self.check_recursive_search.grid(row=4, column=0, columnspan=2, padx=10, pady=5, sticky='w')
+
+        # Number of worker processes used to scan file contents
+        self.label_workers = tk.Label(root, text="Worker processes:")
+        self.label_workers.grid(row=3, column=2, padx=10, pady=5, sticky='e')
+
+        self.var_workers = tk.IntVar(value=os.cpu_count() or 1)
+        self.spin_workers = tk.Spinbox(root, from_=1, to=max(os.cpu_count() or 1, 1) * 2, width=5, textvariable=self.var_workers)
+        self.spin_workers.grid(row=3, column=3, padx=10, pady=5, sticky='w')
+
+        # Content index, answers searches for unchanged files without parsing them again
+        self.var_use_index = tk.BooleanVar()
+        self.check_use_index = tk.Checkbutton(root, text="Use content index", variable=self.var_use_index)
+        self.check_use_index.grid(row=4, column=2, columnspan=2, padx=10, pady=5, sticky='w')
+
+        self.button_refresh_index = tk.Button(root, text="Refresh index", command=lambda: self.start_index_refresh(rebuild=False))
+        self.button_refresh_index.grid(row=1, column=3, padx=10, pady=5)
+
+        self.button_rebuild_index = tk.Button(root, text="Rebuild index", command=lambda: self.start_index_refresh(rebuild=True))
+        self.button_rebuild_index.grid(row=2, column=3, padx=10, pady=5)
+        self.content_index = None
+        self.result_cache = ResultCache(max_bytes=RESULT_CACHE_MB * 1024 * 1024)
+        self.listing_cache = ListingCache()  # Saved in the user data folder, so it survives restarts
+        self.listing_refresher = None
         
         # Control buttons
         self.button_search = tk.Button(root, text="Search", command=self.start_search)
@@ -240,15 +196,44 @@ class App:
 
         self.button_close = tk.Button(root, text="Close", command=self.close_application)
         self.button_close.grid(row=5, column=3, padx=10, pady=5, sticky='w')
-        
-        # Results display
-        self.text_results = tk.Text(root, width=80, height=20)
-        self.text_results.grid(row=6, column=0, columnspan=5, padx=10, pady=10, sticky='nsew')
 
-        # Add scrollbar to the text widget
-        self.scrollbar = tk.Scrollbar(root, command=self.text_results.yview)
-        self.text_results.config(yscrollcommand=self.scrollbar.set)
-        self.scrollbar.grid(row=6, column=5, sticky='nsew')
+        # Per-file timings of the last search or index update, to find the workbooks that dominate the runtime
+        self.button_export_stats = tk.Button(root, text="Export timings", command=self.export_stats, state=tk.DISABLED)
+        self.button_export_stats.grid(row=5, column=4, padx=10, pady=5, sticky='w')
+        
+        # Results display. The result lines are kept in result_lines, and only the lines in view are put in the
+        # text widget, so it stays fast with any number of results. The vertical scrollbar moves through result_lines.
+        self.frame_results = tk.Frame(root)
+        self.frame_results.grid(row=6, column=0, columnspan=6, padx=10, pady=10, sticky='nsew')
+        self.frame_results.grid_rowconfigure(0, weight=1)
+        self.frame_results.grid_columnconfigure(0, weight=1)
+
+        self.text_results = tk.Text(self.frame_results, width=80, height=20, wrap=tk.NONE)
+        self.text_results.grid(row=0, column=0, sticky='nsew')
+
+        self.scrollbar = tk.Scrollbar(self.frame_results, command=self.scroll_results)
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        self.scrollbar_horizontal = tk.Scrollbar(self.frame_results, orient=tk.HORIZONTAL, command=self.text_results.xview)
+        self.text_results.config(xscrollcommand=self.scrollbar_horizontal.set)
+        self.scrollbar_horizontal.grid(row=1, column=0, sticky='ew')
+
+        self.text_results.bind("<MouseWheel>", lambda e: self.scroll_results('scroll', -RESULTS_WHEEL_LINES if e.delta > 0 else RESULTS_WHEEL_LINES, 'units'))
+        self.text_results.bind("<Button-4>", lambda e: self.scroll_results('scroll', -RESULTS_WHEEL_LINES, 'units'))
+        self.text_results.bind("<Button-5>", lambda e: self.scroll_results('scroll', RESULTS_WHEEL_LINES, 'units'))
+        self.text_results.bind("<Prior>", lambda e: self.scroll_results('scroll', -1, 'pages'))
+        self.text_results.bind("<Next>", lambda e: self.scroll_results('scroll', 1, 'pages'))
+        self.text_results.bind("<Configure>", lambda e: self.render_results())
+
+        # File names in the results open their folder when clicked
+        self.text_results.tag_config("link", foreground="blue", underline=True)
+        self.text_results.tag_bind("link", "<Enter>", lambda e: self.text_results.config(cursor="hand2"))
+        self.text_results.tag_bind("link", "<Leave>", lambda e: self.text_results.config(cursor=""))
+        self.text_results.tag_bind("link", "<Button-1>", self.open_result_link)
+        self.result_queue = queue.Queue()
+        self.result_lines = []  # (text, file) per result line, file is set on the lines naming a file, otherwise None
+        self.first_visible_line = 0  # Index in result_lines of the first line in view
+        self.last_result_file = None
+        self.progress_text = None  # Latest progress reported by the search thread, shown by flush_search_results
 
         # Status label
         self.status_label = tk.Label(root, text="Status: Ready")
@@ -263,7 +248,54 @@ class App:
         self.check_include_csv = tk.Checkbutton(root, text="Include CSV files", variable=self.var_include_csv)
         self.check_include_csv.grid(row=5, column=0, columnspan=2, padx=10, pady=5, sticky='w')
 
-        self.last_update_time = 0  # Variable to keep track of the last update time
+        # Search mode options, one checkbox each
+        self.frame_search_options = tk.Frame(root)
+        self.frame_search_options.grid(row=8, column=0, columnspan=5, padx=10, pady=5, sticky='w')
+        self.search_option_vars = {}
+        for name, text in SEARCH_OPTIONS:
+            self.search_option_vars[name] = tk.BooleanVar()
+            tk.Checkbutton(self.frame_search_options, text=text, variable=self.search_option_vars[name]).pack(side=tk.LEFT)
+
+        # Search order and per-file limits, so a few huge workbooks don't hold up all other results
+        self.frame_schedule = tk.Frame(root)
+        self.frame_schedule.grid(row=9, column=0, columnspan=5, padx=10, pady=5, sticky='w')
+        tk.Label(self.frame_schedule, text="Order:").pack(side=tk.LEFT)
+        self.var_order = tk.StringVar(value=next(iter(SEARCH_ORDERS)))
+        tk.OptionMenu(self.frame_schedule, self.var_order, *SEARCH_ORDERS).pack(side=tk.LEFT)
+        tk.Label(self.frame_schedule, text="Max file size (MB):").pack(side=tk.LEFT, padx=(10, 0))
+        self.var_max_file_mb = tk.StringVar()
+        tk.Entry(self.frame_schedule, width=6, textvariable=self.var_max_file_mb).pack(side=tk.LEFT)
+        tk.Label(self.frame_schedule, text="Time limit per file (s):").pack(side=tk.LEFT, padx=(10, 0))
+        self.var_file_timeout = tk.StringVar()
+        tk.Entry(self.frame_schedule, width=6, textvariable=self.var_file_timeout).pack(side=tk.LEFT)
+        self.var_skip_over_budget = tk.BooleanVar()
+        tk.Checkbutton(self.frame_schedule, text="Skip files over a limit (instead of searching them last)",
+                       variable=self.var_skip_over_budget).pack(side=tk.LEFT, padx=(10, 0))
+
+        # Directory listings kept across searches and restarts, so only changed folders are listed again
+        self.frame_listing = tk.Frame(root)
+        self.frame_listing.grid(row=10, column=0, columnspan=5, padx=10, pady=5, sticky='w')
+        self.var_cache_listings = tk.BooleanVar(value=True)
+        tk.Checkbutton(self.frame_listing, text="Cache file lists", variable=self.var_cache_listings,
+                       command=self.update_listing_refresher).pack(side=tk.LEFT)
+        self.var_refresh_listings = tk.BooleanVar()
+        tk.Checkbutton(self.frame_listing, text="Keep them up to date in the background", variable=self.var_refresh_listings,
+                       command=self.update_listing_refresher).pack(side=tk.LEFT, padx=(10, 0))
+
+        # Optional search server (excel_search_server.py) shared with colleagues, searches run there instead of locally
+        self.frame_server = tk.Frame(root)
+        self.frame_server.grid(row=11, column=0, columnspan=5, padx=10, pady=5, sticky='w')
+        tk.Label(self.frame_server, text="Search server (empty to search on this computer):").pack(side=tk.LEFT)
+        self.var_server_url = tk.StringVar()
+        tk.Entry(self.frame_server, width=40, textvariable=self.var_server_url).pack(side=tk.LEFT, padx=(5, 0))
+
+        # Results file (.csv, .jsonl or .xlsx) the matches are written to as they are found, empty for none
+        self.frame_export = tk.Frame(root)
+        self.frame_export.grid(row=12, column=0, columnspan=5, padx=10, pady=5, sticky='w')
+        tk.Label(self.frame_export, text="Export results to:").pack(side=tk.LEFT)
+        self.var_export_path = tk.StringVar()
+        tk.Entry(self.frame_export, width=60, textvariable=self.var_export_path).pack(side=tk.LEFT, padx=(5, 0))
+        tk.Button(self.frame_export, text="Browse", command=self.browse_export_path).pack(side=tk.LEFT, padx=(5, 0))
 
         self.root.bind('<Return>', lambda event: self.start_search())
         self.root.bind('<Escape>', lambda event: self.stop_search())
@@ -272,6 +304,7 @@ class App:
         self.config = configparser.ConfigParser()
         self.config_file = os.path.join(tempfile.gettempdir(), 'app_config.ini')
         self.load_config()
+        self.update_listing_refresher()
 
     #-----------------------------------------------------------------------------------------------------------------------------
     def load_config(self):
@@ -284,6 +317,20 @@ class App:
             self.var_open_in_editor.set(self.config.getboolean('LAST_INPUTS', 'open_in_editor', fallback=False))
             self.var_recursive_search.set(self.config.getboolean('LAST_INPUTS', 'recursive_search', fallback=False))
             self.var_include_csv.set(self.config.getboolean('LAST_INPUTS', 'include_csv', fallback=False))
+            self.var_workers.set(self.config.getint('LAST_INPUTS', 'workers', fallback=os.cpu_count() or 1))
+            self.var_use_index.set(self.config.getboolean('LAST_INPUTS', 'use_index', fallback=False))
+            for name, var in self.search_option_vars.items():
+                var.set(self.config.getboolean('LAST_INPUTS', name, fallback=False))
+            order = self.config.get('LAST_INPUTS', 'order', fallback='')
+            if order in SEARCH_ORDERS:
+                self.var_order.set(order)
+            self.var_max_file_mb.set(self.config.get('LAST_INPUTS', 'max_file_mb', fallback=''))
+            self.var_file_timeout.set(self.config.get('LAST_INPUTS', 'file_timeout', fallback=''))
+            self.var_skip_over_budget.set(self.config.getboolean('LAST_INPUTS', 'skip_over_budget', fallback=False))
+            self.var_cache_listings.set(self.config.getboolean('LAST_INPUTS', 'cache_listings', fallback=True))
+            self.var_refresh_listings.set(self.config.getboolean('LAST_INPUTS', 'refresh_listings', fallback=False))
+            self.var_server_url.set(self.config.get('LAST_INPUTS', 'server_url', fallback=''))
+            self.var_export_path.set(self.config.get('LAST_INPUTS', 'export_path', fallback=''))
     
     #-----------------------------------------------------------------------------------------------------------------------------
     def save_config(self):
@@ -296,6 +343,18 @@ class App:
         self.config.set('LAST_INPUTS', 'open_in_editor', str(self.var_open_in_editor.get()))
         self.config.set('LAST_INPUTS', 'recursive_search', str(self.var_recursive_search.get()))
         self.config.set('LAST_INPUTS', 'include_csv', str(self.var_include_csv.get()))
+        self.config.set('LAST_INPUTS', 'workers', str(self.get_workers()))
+        self.config.set('LAST_INPUTS', 'use_index', str(self.var_use_index.get()))
+        for name, var in self.search_option_vars.items():
+            self.config.set('LAST_INPUTS', name, str(var.get()))
+        self.config.set('LAST_INPUTS', 'order', self.var_order.get())
+        self.config.set('LAST_INPUTS', 'max_file_mb', self.var_max_file_mb.get())
+        self.config.set('LAST_INPUTS', 'file_timeout', self.var_file_timeout.get())
+        self.config.set('LAST_INPUTS', 'skip_over_budget', str(self.var_skip_over_budget.get()))
+        self.config.set('LAST_INPUTS', 'cache_listings', str(self.var_cache_listings.get()))
+        self.config.set('LAST_INPUTS', 'refresh_listings', str(self.var_refresh_listings.get()))
+        self.config.set('LAST_INPUTS', 'server_url', self.var_server_url.get())
+        self.config.set('LAST_INPUTS', 'export_path', self.var_export_path.get())
         with open(self.config_file, 'w') as configfile:
             self.config.write(configfile)
 
@@ -310,20 +369,36 @@ class App:
             self.entry_path.delete(0, tk.END)
             self.entry_path.insert(0, folder_selected)
 
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def browse_export_path(self):
+        """Choose the file the results are exported to. Its extension decides the format."""
+        file_path = filedialog.asksaveasfilename(title="Export results to", defaultextension='.csv',
+                                                 filetypes=[("CSV files", "*.csv"), ("JSON Lines files", "*.jsonl"),
+                                                            ("Excel workbooks", "*.xlsx"), ("All files", "*.*")])
+        if file_path:
+            self.var_export_path.set(file_path)
+
     #-----------------------------------------------------------------------------------------------------------------------------
     def start_search(self):
         """Start the search in a new thread."""
         self.search_forced_stop = False
         self.searching = True
+        self.pause_listing_refresher()
         self.button_search.config(state=tk.DISABLED)
         self.button_stop_search.config(state=tk.NORMAL)
-        self.text_results.delete(1.0, tk.END)
+        self.result_queue = queue.Queue()
+        self.result_lines = []
+        self.first_visible_line = 0
+        self.last_result_file = None
+        self.progress_text = None
+        self.render_results()
+        self.root.after(RESULTS_FLUSH_MS, self.flush_search_results)
         self.status_label.config(text="Status: Searching...")
         start_index = self.text_results.index(tk.INSERT)
         self.root.after(0, lambda si=start_index, fn=f"Searching:": "Dir: ")
-        search_thread = threading.Thread(target=self.search_files)
-        search_thread.daemon = True  # Make the thread a daemon thread
-        search_thread.start()
+        self.search_thread = threading.Thread(target=self.search_files)
+        self.search_thread.daemon = True  # Make the thread a daemon thread
+        self.search_thread.start()
 
     #-----------------------------------------------------------------------------------------------------------------------------
     def stop_search(self):
@@ -344,93 +419,323 @@ class App:
         open_in_editor = self.var_open_in_editor.get()
         recursive_search = self.var_recursive_search.get()
         include_csv = self.var_include_csv.get()  # Get the state of the CSV inclusion checkbox
+        workers = self.get_workers()
+        server_url = self.var_server_url.get().strip()
 
         if not path or not fname_match or not search_text:
             self.root.after(0, lambda: messagebox.showwarning("Input Error", "Please provide path, filename match, and search text."))
             self.searching = False
             self.root.after(0, lambda: self.button_search.config(state=tk.NORMAL))
             self.root.after(0, lambda: self.button_stop_search.config(state=tk.DISABLED))
+            self.root.after(0, self.update_listing_refresher)
             return
 
-        if not os.path.exists(path):
+        if not server_url and not os.path.exists(path):  # A search server checks the path itself
             self.root.after(0, lambda: self.status_label.config(text="Status: The specified directory does not exist"))
             self.searching = False
             self.root.after(0, lambda: self.button_search.config(state=tk.NORMAL))
             self.root.after(0, lambda: self.button_stop_search.config(state=tk.DISABLED))
+            self.root.after(0, self.update_listing_refresher)
+            return
+
+        options = {name: var.get() for name, var in self.search_option_vars.items()}
+        terms = [term.strip() for term in search_text.split(';')] if options.pop('multiple_terms') else [search_text]
+        try:
+            query = SearchQuery(terms, **options)
+        except (ValueError, re.error) as e:
+            self.root.after(0, lambda: messagebox.showwarning("Input Error", f"Invalid search text: {e}"))
+            self.searching = False
+            self.root.after(0, lambda: self.button_search.config(state=tk.NORMAL))
+            self.root.after(0, lambda: self.button_stop_search.config(state=tk.DISABLED))
+            self.root.after(0, self.update_listing_refresher)
+            return
+
+        # The matches are written to the export file and the editor's temp file as they are found, so nothing is
+        # collected in memory and what was found before a stop or an error is kept
+        export_path = self.var_export_path.get().strip()
+        exporters = []
+        editor_file = None
+        try:
+            if export_path:
+                exporters.append(open_exporter(export_path))
+            if open_in_editor:
+                with tempfile.NamedTemporaryFile(delete=False, prefix="jentmp_", suffix='.txt') as temp_file:
+                    editor_file = temp_file.name
+                exporters.append(TextExporter(editor_file))
+        except (OSError, ValueError) as e:
+            for exporter in exporters:
+                exporter.close()
+            self.root.after(0, lambda: messagebox.showwarning("Export Error", f"Can't export the results to {export_path}: {e}"))
+            self.searching = False
+            self.root.after(0, lambda: self.button_search.config(state=tk.NORMAL))
+            self.root.after(0, lambda: self.button_stop_search.config(state=tk.DISABLED))
+            self.root.after(0, self.update_listing_refresher)
             return
 
-        self.searcher = ExcelSearcher(path, recursive=recursive_search)
-        found_files = self.searcher.search_excel_files_with_text(fname_match, search_text, self.update_progress, self.update_search_results, include_csv)
+        if server_url:
+            self.searcher = RemoteSearcher(server_url, path, use_index=self.var_use_index.get(), recursive=recursive_search,
+                                           **self.get_schedule_options())
+        else:
+            index = self.get_content_index() if self.var_use_index.get() else None
+            self.searcher = ExcelSearcher(path, recursive=recursive_search, workers=workers, index=index, result_cache=self.result_cache,
+                                          listing_cache=self.get_listing_cache(), isolate=True, **self.get_schedule_options())
+        result_queue = self.result_queue  # Keep this search's queue, a new search replaces self.result_queue
+        found = 0
+        server_error = None
+
+        # Matches are handed to the UI thread through the queue as they are found, see flush_search_results
+        try:
+            for match in self.searcher.iter_matches(fname_match, query, self.update_progress, include_csv):
+                for exporter in exporters:
+                    exporter.write(match)
+                result_queue.put(match)
+                found += 1
+        except (OSError, SearchServerError) as e:
+            if not server_url:
+                raise
+            # The search server refused the search or can't be reached
+            server_error = str(getattr(e, 'reason', e))
+            self.root.after(0, lambda: messagebox.showerror("Search Server Error", f"The search failed on {server_url}: {server_error}"))
+        finally:
+            for exporter in exporters:
+                exporter.close()
+
+        if found and open_in_editor and self.searching:
+            self.open_temp_file(editor_file)
+        elif editor_file:
+            os.remove(editor_file)
+        if not found and not self.search_forced_stop and server_error is None:
+            self.root.after(0, lambda: messagebox.showinfo("No Results", "No matching files found."))
 
-        if found_files:
-            self.root.after(0, lambda: self.text_results.delete(1.0, tk.END))
-            self.root.after(0, lambda: self.text_results.tag_config("link", foreground="blue", underline=True))
-            self.root.after(0, lambda: self.text_results.tag_bind("link", "<Enter>", lambda e: self.text_results.config(cursor="hand2")))
-            self.root.after(0, lambda: self.text_results.tag_bind("link", "<Leave>", lambda e: self.text_results.config(cursor="")))
+        self.save_config()  # Save the current inputs
 
-            results = []  # Store results for text editor
+        self.searching = False
+        self.root.after(0, lambda: self.button_search.config(state=tk.NORMAL))
+        self.root.after(0, lambda: self.button_stop_search.config(state=tk.DISABLED))
+        self.root.after(0, lambda: self.button_export_stats.config(state=tk.NORMAL))
+        self.root.after(0, self.update_listing_refresher)
+        skipped = len(self.searcher.skipped_files)
+        elapsed = self.searcher.stats.elapsed or 0
+        status = f"Status: Search done in {elapsed:.1f} s"
+        if skipped:
+            status += f", {skipped} file(s) skipped"
+        if export_path:
+            status += f", {found} match(es) exported"
+        if server_error is not None:
+            status = "Status: Search failed on the server"
+        self.root.after(0, lambda: self.status_label.config(text=status))
+        if DEBUG:
+            for file, reason in self.searcher.skipped_files:
+                print(f"Skipped {file}: {reason}")
+            for file_stats in self.searcher.stats.slowest(10):
+                print(f"{file_stats['seconds']:8.3f} s  {file_stats['parser']:<10} {file_stats['file']}")
 
-            for file, found_rows in found_files:
-                if not self.searching:
-                    break
-                subdir_name = os.path.basename(os.path.dirname(file))
-                file_name = os.path.basename(file)
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def get_content_index(self):
+        """Return the content index, opening it on first use."""
+        if self.content_index is None:
+            self.content_index = ContentIndex()
+        return self.content_index
 
-                # Pass the full file path to the update_search_results function
-                self.root.after(0, lambda fp=file, s=subdir_name, f=file_name, r=found_rows: self.update_search_results(fp, s, f, r))
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def get_listing_cache(self):
+        """Return the directory listing cache, or None if file lists are not cached."""
+        return self.listing_cache if self.var_cache_listings.get() else None
 
-                results.append((subdir_name, file_name, found_rows))
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def update_listing_refresher(self):
+        """
+        Keep the file lists of the current folder warm in the background while no search runs, if enabled.
+        The refresher is restarted when the folder or the recursion changed since it was started.
+        """
+        path = self.entry_path.get()
+        enabled = self.var_cache_listings.get() and self.var_refresh_listings.get() and os.path.isdir(path)
+        refresher = self.listing_refresher
+        if refresher is not None:
+            if enabled and (refresher.searcher.base_folder, refresher.searcher.recursive) == (path, self.var_recursive_search.get()):
+                if not self.searching:
+                    refresher.resume()
+                return
+            refresher.stop()
+            self.listing_refresher = None
+        if enabled:
+            searcher = ExcelSearcher(path, recursive=self.var_recursive_search.get(), listing_cache=self.listing_cache)
+            self.listing_refresher = ListingRefresher(searcher, LISTING_REFRESH_SECONDS).start()
+            if self.searching:
+                self.listing_refresher.pause()
 
-            if open_in_editor and self.searching:
-                temp_file_path = self.write_results_to_temp_file(results)
-                self.open_temp_file(temp_file_path)
-        else:
-            if not self.search_forced_stop:
-                self.root.after(0, lambda: messagebox.showinfo("No Results", "No matching files found."))
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def pause_listing_refresher(self):
+        """Interrupt the background refresh of the file lists for the duration of a search."""
+        if self.listing_refresher is not None:
+            self.listing_refresher.pause()
 
-        self.save_config()  # Save the current inputs
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def start_index_refresh(self, rebuild=False):
+        """Refresh or rebuild the content index for the current path and filename match in a new thread."""
+        path = self.entry_path.get()
+        if not path or not os.path.exists(path):
+            messagebox.showwarning("Input Error", "Please provide an existing path to index.")
+            return
+        self.search_forced_stop = False
+        self.searching = True
+        self.pause_listing_refresher()
+        self.button_search.config(state=tk.DISABLED)
+        self.button_refresh_index.config(state=tk.DISABLED)
+        self.button_rebuild_index.config(state=tk.DISABLED)
+        self.button_stop_search.config(state=tk.NORMAL)
+        self.status_label.config(text="Status: Rebuilding index..." if rebuild else "Status: Refreshing index...")
+        self.progress_text = None
+        self.root.after(RESULTS_FLUSH_MS, self.flush_search_results)  # Shows the progress
+        self.searcher = ExcelSearcher(path, recursive=self.var_recursive_search.get(), workers=self.get_workers(), index=self.get_content_index(),
+                                      listing_cache=self.get_listing_cache(), isolate=True, **self.get_schedule_options())
+        index_thread = threading.Thread(target=self.refresh_index, args=(self.entry_fname_match.get(), self.var_include_csv.get(), rebuild))
+        index_thread.daemon = True
+        index_thread.start()
 
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def refresh_index(self, fname_match, include_csv, rebuild):
+        """Bring the content index up to date and report how many files were parsed."""
+        parsed = self.searcher.refresh_index(fname_match, self.update_progress, include_csv, rebuild)
+        skipped = len(self.searcher.skipped_files)
+        status = f"Status: Index updated, {parsed} file(s) parsed, {skipped} skipped"
+        if self.search_forced_stop:
+            status = "Status: Index update stopped"
         self.searching = False
         self.root.after(0, lambda: self.button_search.config(state=tk.NORMAL))
+        self.root.after(0, lambda: self.button_refresh_index.config(state=tk.NORMAL))
+        self.root.after(0, lambda: self.button_rebuild_index.config(state=tk.NORMAL))
         self.root.after(0, lambda: self.button_stop_search.config(state=tk.DISABLED))
-        self.root.after(0, lambda: self.status_label.config(text="Status: Search done"))
+        self.root.after(0, lambda: self.button_export_stats.config(state=tk.NORMAL))
+        self.root.after(0, lambda: self.status_label.config(text=status))
+        self.root.after(0, self.update_listing_refresher)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def export_stats(self):
+        """Save the per-file timings and the summary of the last search or index update as a JSON file."""
+        file_path = filedialog.asksaveasfilename(title="Export timings", defaultextension='.json',
+                                                 filetypes=[("JSON files", "*.json"), ("All files", "*.*")])
+        if not file_path:
+            return
+        try:
+            self.searcher.stats.write_json(file_path)
+        except OSError as e:
+            messagebox.showerror("Export Error", f"Could not write {file_path}: {e}")
+            return
+        self.status_label.config(text=f"Status: Timings exported to {shorten_path_pixels(file_path, widget=self.status_label)}")
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def get_schedule_options(self):
+        """Return the search order and per-file limit arguments for the ExcelSearcher, ignoring empty or invalid limits."""
+        def positive_number(text):
+            try:
+                value = float(text)
+            except ValueError:
+                return None
+            return value if value > 0 else None
+
+        max_file_mb = positive_number(self.var_max_file_mb.get())
+        return {
+            'order': SEARCH_ORDERS.get(self.var_order.get()),
+            'max_file_size': int(max_file_mb * 1024 * 1024) if max_file_mb else None,
+            'file_timeout': positive_number(self.var_file_timeout.get()),
+            'over_budget': 'skip' if self.var_skip_over_budget.get() else 'defer',
+        }
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def get_workers(self):
+        """Return the number of worker processes entered by the user, falling back to 1 on invalid input."""
+        try:
+            return max(1, int(self.var_workers.get()))
+        except (tk.TclError, ValueError):
+            return 1
 
     #-----------------------------------------------------------------------------------------------------------------------------
     def update_progress(self, current_subdir):
-        """Update the status label with the current subdirectory being searched."""
-        current_time = time.time()
-        elapsed_time = current_time - self.last_update_time
+        """Remember the subdirectory being searched, called from the search thread. The label is updated by flush_search_results."""
+        self.progress_text = current_subdir
 
-        if elapsed_time >= 0.1:
-            def update_text():
-                self.status_label.config(text=f"Searching in: {shorten_path_pixels(current_subdir, widget=self.status_label)}")
-                self.last_update_time = time.time()
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def flush_search_results(self):
+        """
+        Moves the matches queued by the search thread into result_lines and shows the latest progress, in one batch
+        per interval and for at most RESULTS_FLUSH_BUDGET seconds, so the window stays responsive while matches
+        come in at full speed. Reschedules itself while searching.
+        """
+        deadline = time.perf_counter() + RESULTS_FLUSH_BUDGET
+        previous_count = len(self.result_lines)
+        lines = self.result_lines
+        while time.perf_counter() < deadline:
+            try:
+                for _ in range(100):
+                    match = self.result_queue.get_nowait()
+                    if match.file != self.last_result_file:
+                        self.last_result_file = match.file
+                        subdir_name = os.path.basename(os.path.dirname(match.file))
+                        lines.append((f"{subdir_name}/{os.path.basename(match.file)}", match.file))
+                    lines.append(("    " + ', '.join([str(cell) for cell in match.row]), None))
+            except queue.Empty:
+                break
+
+        if len(lines) != previous_count:
+            if self.first_visible_line + self.visible_line_count() > previous_count:
+                self.render_results()  # The new lines are in view
+            else:
+                self.update_results_scrollbar()
 
-            self.root.after(0, update_text)
+        progress_text = self.progress_text
+        if self.searching and progress_text is not None:
+            self.progress_text = None
+            self.status_label.config(text=f"Searching in: {shorten_path_pixels(progress_text, widget=self.status_label)}")
+
+        if self.searching or not self.result_queue.empty():
+            self.root.after(RESULTS_FLUSH_MS, self.flush_search_results)
 
     #-----------------------------------------------------------------------------------------------------------------------------
-    def update_search_results(self, full_path, subdir_name, file_name, found_rows):
-        """Update the search results in the text widget."""
-        start_index = self.text_results.index(tk.INSERT)
-        self.text_results.insert(tk.END, f"{subdir_name}/{file_name}\n")
-        end_index = self.text_results.index(tk.INSERT)
-        self.text_results.tag_add("link", start_index, end_index)
-        self.text_results.tag_bind("link", "<Button-1>", lambda event, fp=full_path: self.open_file_location(fp))
-        
-        for row in found_rows:
-            row_data = ', '.join([str(cell) for cell in row])
-            self.text_results.insert(tk.END, f"    {row_data}\n")
+    def visible_line_count(self):
+        """Return the number of result lines that fit in the text widget."""
+        line_height = get_font(str(self.text_results.cget("font"))).metrics("linespace")
+        return max(1, self.text_results.winfo_height() // max(1, line_height))
 
     #-----------------------------------------------------------------------------------------------------------------------------
-    def write_results_to_temp_file(self, results):
-        """Write search results to a temporary file."""
-        with tempfile.NamedTemporaryFile(delete=False, prefix="jentmp_", suffix='.txt', mode='w') as temp_file:
-            for subdir_name, file_name, rows in results:
-                temp_file.write(f"{subdir_name}/{file_name}\n")
-                for row in rows:
-                    row_data = ', '.join([str(cell) for cell in row])
-                    temp_file.write(f"    {row_data}\n")
-        return temp_file.name
+    def render_results(self):
+        """Put the result lines in view into the text widget, replacing the previous ones."""
+        visible = self.visible_line_count()
+        chunks = []
+        for text, file in self.result_lines[self.first_visible_line:self.first_visible_line + visible]:
+            chunks += [text + "\n", ("link",) if file else ()]
+        self.text_results.delete(1.0, tk.END)
+        if chunks:
+            self.text_results.insert(tk.END, *chunks)
+        self.update_results_scrollbar()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def update_results_scrollbar(self):
+        total = len(self.result_lines)
+        if not total:
+            self.scrollbar.set(0, 1)
+            return
+        self.scrollbar.set(self.first_visible_line / total, min(1, (self.first_visible_line + self.visible_line_count()) / total))
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def scroll_results(self, action, amount, unit=None):
+        """Scrollbar command, also used for the mouse wheel and page keys: move the result lines in view."""
+        visible = self.visible_line_count()
+        if action == 'moveto':
+            first = int(float(amount) * len(self.result_lines))
+        else:
+            first = self.first_visible_line + int(amount) * (visible if unit == 'pages' else 1)
+        self.first_visible_line = max(0, min(first, len(self.result_lines) - visible))
+        self.render_results()
+        return "break"
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def open_result_link(self, event):
+        """Open the location of the file whose name was clicked in the results."""
+        line = int(self.text_results.index(f"@{event.x},{event.y}").split('.')[0])
+        position = self.first_visible_line + line - 1
+        if position < len(self.result_lines) and self.result_lines[position][1]:
+            self.open_file_location(self.result_lines[position][1])
 
     #-----------------------------------------------------------------------------------------------------------------------------
     def open_temp_file(self, temp_file_path):
@@ -456,12 +761,28 @@ class App:
     #-----------------------------------------------------------------------------------------------------------------------------
     def close_application(self):
         """Close the application, stopping the search if ongoing."""
+        self.button_close.config(state=tk.DISABLED)
         if self.searching:
             self.stop_search()
+        if self.listing_refresher is not None:
+            self.listing_refresher.stop()
+        self.exit_after_search()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def exit_after_search(self, waited_ms=0):
+        """
+        Exit once the search thread has finished, so the export files it closes on the way out are complete.
+        The window keeps processing events meanwhile, as the search thread hands its last updates to it.
+        """
+        if self.search_thread is not None and self.search_thread.is_alive() and waited_ms < CLOSE_WAIT_MS:
+            self.root.after(50, self.exit_after_search, waited_ms + 50)
+            return
         self.root.destroy()
         os._exit(0)
 
 # Run the app
-root = tk.Tk()
-app = App(root)
-root.mainloop()
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = App(root)
+    root.mainloop()
+
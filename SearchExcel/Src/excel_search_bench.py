@@ -0,0 +1,415 @@
+"""
+Benchmark harness for ExcelSearcher, with a generator for a synthetic corpus of workbooks.
+
+Examples:
+    python excel_search_bench.py generate /tmp/corpus --files 2000 --mix xlsx=5,xlsm=1,xls=1,csv=3 --match-density 0.05
+    python excel_search_bench.py run /tmp/corpus --needle NEEDLE-4711 --workers 4 --output results.json
+
+Every measurement runs in a freshly spawned process, so its peak RSS is not inflated by the previous ones and the
+time to the first match is measured without the imports, worker processes and caches of an earlier search.
+The peak RSS of a search adds up the peaks of the worker processes, as reported with each file they searched.
+The results are written as JSON, to compare runs across versions.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+from excel_searcher import ExcelSearcher, SearchQuery, peak_rss_bytes
+
+DEFAULT_NEEDLE = 'NEEDLE-4711'
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima',
+         'part', 'order', 'supplier', 'invoice', 'qty', 'price', 'total', 'remark', 'Æble', 'Øre', 'Straße', 'café']
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def column_letter(index):
+    """Return the spreadsheet column name for a 0-based column index."""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def make_rows(rng, rows, cols, needle=None):
+    """Return rows of random words and numbers. If a needle is given, it is put in one random cell."""
+    data = []
+    for _ in range(rows):
+        data.append([rng.choice(WORDS) + str(rng.randint(0, 99999)) if rng.random() < 0.6 else rng.randint(0, 1000000)
+                     for _ in range(cols)])
+    if needle and rows and cols:
+        data[rng.randrange(rows)][rng.randrange(cols)] = f"{rng.choice(WORDS)} {needle}"
+    return data
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def write_xlsx(file_path, rows, shared_strings=True, macro_enabled=False):
+    """
+    Writes a minimal .xlsx/.xlsm package directly, so the generator controls whether strings are shared or inline.
+    openpyxl always writes one of the two, real files from Excel mostly use shared strings.
+    """
+    strings = {}
+    sheet = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+             '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>']
+    for row_idx, row in enumerate(rows, start=1):
+        sheet.append(f'<row r="{row_idx}">')
+        for col_idx, value in enumerate(row):
+            ref = f'{column_letter(col_idx)}{row_idx}'
+            if isinstance(value, str):
+                if shared_strings:
+                    sheet.append(f'<c r="{ref}" t="s"><v>{strings.setdefault(value, len(strings))}</v></c>')
+                else:
+                    sheet.append(f'<c r="{ref}" t="inlineStr"><is><t>{escape(value)}</t></is></c>')
+            else:
+                sheet.append(f'<c r="{ref}"><v>{value}</v></c>')
+        sheet.append('</row>')
+    sheet.append('</sheetData></worksheet>')
+
+    main_type = ('application/vnd.ms-excel.sheet.macroEnabled.main+xml' if macro_enabled
+                 else 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml')
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f'<Override PartName="/xl/workbook.xml" ContentType="{main_type}"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        + ('<Override PartName="/xl/sharedStrings.xml" '
+           'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>' if shared_strings else '')
+        + '</Types>')
+    root_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>')
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>')
+    workbook_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        + ('<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" '
+           'Target="sharedStrings.xml"/>' if shared_strings else '')
+        + '</Relationships>')
+
+    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', content_types)
+        archive.writestr('_rels/.rels', root_rels)
+        archive.writestr('xl/workbook.xml', workbook)
+        archive.writestr('xl/_rels/workbook.xml.rels', workbook_rels)
+        archive.writestr('xl/worksheets/sheet1.xml', ''.join(sheet))
+        if shared_strings:
+            items = ''.join(f'<si><t>{escape(text)}</t></si>' for text in strings)
+            archive.writestr('xl/sharedStrings.xml',
+                             '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                             '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                             f'count="{len(strings)}" uniqueCount="{len(strings)}">{items}</sst>')
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def write_xls(file_path, rows):
+    """Writes a legacy .xls workbook with xlwt, which is only needed for generating the corpus."""
+    import xlwt
+
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('Sheet1')
+    for row_idx, row in enumerate(rows[:65536]):  # The BIFF8 row limit
+        for col_idx, value in enumerate(row[:256]):
+            sheet.write(row_idx, col_idx, value)
+    workbook.save(file_path)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def write_csv(file_path, rows, encoding='utf-8', delimiter=';'):
+    with open(file_path, 'w', newline='', encoding=encoding, errors='replace') as csvfile:
+        csv.writer(csvfile, delimiter=delimiter).writerows(rows)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def parse_mix(mix):
+    """Parse 'xlsx=5,csv=2' into {'xlsx': 5.0, 'csv': 2.0}."""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip().lstrip('.')] = float(weight or 1)
+    return weights
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def generate_corpus(target, files=200, mix='xlsx=5,xlsm=1,xls=1,csv=3', rows=(50, 2000), cols=(5, 20), depth=3, fanout=4,
+                    match_density=0.05, needle=DEFAULT_NEEDLE, shared_strings=0.8, encodings='utf-8,utf-8-sig,cp1252,utf-16',
+                    seed=1):
+    """
+    Generates a corpus of workbooks in nested directories below target.
+
+    Args:
+        target (str): The folder to create the corpus in.
+        files (int): The number of files to generate.
+        mix (str): Relative weights of the formats, e.g. 'xlsx=5,xlsm=1,xls=1,csv=3'.
+        rows (tuple): Minimum and maximum number of rows per file.
+        cols (tuple): Minimum and maximum number of columns per file.
+        depth (int): Maximum directory depth below target.
+        fanout (int): Number of subdirectories per directory.
+        match_density (float): Fraction of the files that contain the needle.
+        needle (str): The text planted in the matching files.
+        shared_strings (float): Fraction of the .xlsx/.xlsm files using shared instead of inline strings.
+        encodings (str): Comma separated encodings the CSV files are spread over.
+        seed (int): Seed of the random generator, the same seed gives the same corpus.
+
+    Returns:
+        dict: A description of the generated corpus, including the number of files and bytes per format.
+    """
+    rng = random.Random(seed)
+    weights = parse_mix(mix)
+    if 'xls' in weights:
+        try:
+            import xlwt  # noqa: F401
+        except ImportError:
+            print("xlwt is not installed, no .xls files are generated", file=sys.stderr)
+            del weights['xls']
+    formats, format_weights = list(weights), list(weights.values())
+    encodings = encodings.split(',')
+
+    directories = [target]
+    frontier = [(target, 0)]
+    while frontier:
+        folder, level = frontier.pop()
+        if level < depth:
+            for index in range(fanout):
+                subfolder = os.path.join(folder, f'dir{level + 1}_{index}')
+                directories.append(subfolder)
+                frontier.append((subfolder, level + 1))
+    for folder in directories:
+        os.makedirs(folder, exist_ok=True)
+
+    summary = {'files': 0, 'bytes': 0, 'matching_files': 0, 'per_format': {}}
+    for index in range(files):
+        file_format = rng.choices(formats, format_weights)[0]
+        matching = rng.random() < match_density
+        data = make_rows(rng, rng.randint(*rows), rng.randint(*cols), needle if matching else None)
+        file_path = os.path.join(rng.choice(directories), f'book{index:06d}.{file_format}')
+        if file_format in ('xlsx', 'xlsm', 'xltx'):
+            write_xlsx(file_path, data, shared_strings=rng.random() < shared_strings, macro_enabled=file_format == 'xlsm')
+        elif file_format == 'xls':
+            write_xls(file_path, data)
+        elif file_format == 'csv':
+            write_csv(file_path, data, encoding=rng.choice(encodings))
+        else:
+            raise ValueError(f"Unsupported format: {file_format}")
+
+        size = os.path.getsize(file_path)
+        stats = summary['per_format'].setdefault(file_format, {'files': 0, 'bytes': 0})
+        stats['files'] += 1
+        stats['bytes'] += size
+        summary['files'] += 1
+        summary['bytes'] += size
+        summary['matching_files'] += matching
+    return summary
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def search_peak_rss(searcher):
+    """
+    Return the peak RSS of this process plus that of every worker process of the last search, in bytes, or None
+    where it can't be measured. The workers are started by a fork server, not by this process, so RUSAGE_CHILDREN
+    doesn't see them; each one reports its peak with the files it searched. As the peaks of the processes don't
+    need to coincide, the sum is an upper bound of the memory used at any one time.
+    """
+    own = peak_rss_bytes()
+    if own is None:
+        return None
+    workers = {}
+    for file_stats in searcher.stats.files:
+        if file_stats['pid'] not in (None, os.getpid()) and file_stats['peak_rss'] is not None:
+            workers[file_stats['pid']] = max(workers.get(file_stats['pid'], 0), file_stats['peak_rss'])
+    return own + sum(workers.values())
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def file_format(file_path):
+    return os.path.splitext(file_path)[1].lower().lstrip('.')
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def measure_enumeration(corpus, fname_match, include_csv):
+    searcher = ExcelSearcher(corpus, recursive=True)
+    searcher.searching = True
+    start = time.perf_counter()
+    files = searcher.search_excel_files(fname_match, include_csv=include_csv)
+    return {'seconds': time.perf_counter() - start, 'files': len(files), 'peak_rss_bytes': peak_rss_bytes()}
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def measure_per_format(corpus, fname_match, include_csv, needle):
+    """Search every file on its own, sequentially, and aggregate the throughput per format."""
+    searcher = ExcelSearcher(corpus, recursive=True)
+    searcher.searching = True
+    query = SearchQuery(needle)
+    per_format = {}
+    for file in searcher.search_excel_files(fname_match, include_csv=include_csv):
+        stats = per_format.setdefault(file_format(file), {'files': 0, 'bytes': 0, 'seconds': 0.0, 'matches': 0, 'errors': 0})
+        start = time.perf_counter()
+        try:
+            stats['matches'] += bool(searcher.find_matches(file, query))
+        except Exception:
+            stats['errors'] += 1
+        stats['seconds'] += time.perf_counter() - start
+        stats['files'] += 1
+        stats['bytes'] += os.path.getsize(file)
+    for stats in per_format.values():
+        seconds = stats['seconds'] or float('nan')
+        stats['files_per_second'] = stats['files'] / seconds
+        stats['mb_per_second'] = stats['bytes'] / 1e6 / seconds
+    return {'per_format': per_format, 'peak_rss_bytes': peak_rss_bytes()}
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def measure_first_match(corpus, fname_match, include_csv, needle, workers):
+    """Run iter_matches up to the first match, as the first search of a fresh process."""
+    searcher = ExcelSearcher(corpus, recursive=True, workers=workers)
+    first_match = None
+    start = time.perf_counter()
+    matches = searcher.iter_matches(fname_match, needle, include_csv=include_csv)
+    for _ in matches:
+        first_match = time.perf_counter() - start
+        break
+    matches.close()
+    return {'time_to_first_match': first_match}
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def measure_search(corpus, fname_match, include_csv, needle, workers):
+    """Run search_excel_files_with_text over the whole corpus."""
+    searcher = ExcelSearcher(corpus, recursive=True, workers=workers)
+    start = time.perf_counter()
+    found = searcher.search_excel_files_with_text(fname_match, needle, include_csv=include_csv)
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'matching_files': len(found), 'skipped_files': len(searcher.skipped_files),
+            'peak_rss_bytes': search_peak_rss(searcher)}
+
+MEASUREMENTS = (measure_enumeration, measure_first_match, measure_per_format, measure_search)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def run_isolated(function, *args):
+    """Run a measurement in a fresh interpreter, so its peak RSS is its own."""
+    # A plain child process rather than a multiprocessing worker: those can't reliably start the searcher's own pool
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), 'measure', function.__name__, json.dumps(args)],
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def run_benchmark(corpus, needle=DEFAULT_NEEDLE, fname_match='', include_csv=True, workers=(1,), repeat=1):
+    """
+    Runs all measurements on a corpus.
+
+    Args:
+        corpus (str): The folder to search.
+        needle (str): The text to search for.
+        fname_match (str): The filename match passed to the searcher.
+        include_csv (bool): Also search CSV files.
+        workers (tuple): Worker process counts to run the full search with.
+        repeat (int): Number of times each measurement is repeated.
+
+    Returns:
+        dict: The results, ready to be written as JSON.
+    """
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'corpus': os.path.abspath(corpus),
+        'needle': needle,
+        'fname_match': fname_match,
+        'include_csv': include_csv,
+        'enumeration': [],
+        'per_format': [],
+        'search': {},
+    }
+    for _ in range(repeat):
+        results['enumeration'].append(run_isolated(measure_enumeration, corpus, fname_match, include_csv))
+        # Before the measurements that read every file, which would leave them in the OS file cache
+        first_matches = {count: run_isolated(measure_first_match, corpus, fname_match, include_csv, needle, count)
+                         for count in workers}
+        results['per_format'].append(run_isolated(measure_per_format, corpus, fname_match, include_csv, needle))
+        for count in workers:
+            search = run_isolated(measure_search, corpus, fname_match, include_csv, needle, count)
+            results['search'].setdefault(str(count), []).append({**search, **first_matches[count]})
+    return results
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def parse_range(text):
+    low, _, high = text.partition('-')
+    return int(low), int(high or low)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic workbook corpus and benchmark ExcelSearcher on it.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="Generate a corpus")
+    generate.add_argument('target', help="Folder to create the corpus in")
+    generate.add_argument('--files', type=int, default=200)
+    generate.add_argument('--mix', default='xlsx=5,xlsm=1,xls=1,csv=3', help="Relative weights of the formats")
+    generate.add_argument('--rows', type=parse_range, default=(50, 2000), help="Rows per file, e.g. 50-2000")
+    generate.add_argument('--cols', type=parse_range, default=(5, 20), help="Columns per file, e.g. 5-20")
+    generate.add_argument('--depth', type=int, default=3, help="Directory depth")
+    generate.add_argument('--fanout', type=int, default=4, help="Subdirectories per directory")
+    generate.add_argument('--match-density', type=float, default=0.05, help="Fraction of files containing the needle")
+    generate.add_argument('--needle', default=DEFAULT_NEEDLE)
+    generate.add_argument('--shared-strings', type=float, default=0.8, help="Fraction of .xlsx/.xlsm files with shared strings")
+    generate.add_argument('--encodings', default='utf-8,utf-8-sig,cp1252,utf-16', help="Encodings of the CSV files")
+    generate.add_argument('--seed', type=int, default=1)
+
+    run = commands.add_parser('run', help="Benchmark searches on a corpus")
+    run.add_argument('corpus', help="Folder to search")
+    run.add_argument('--needle', default=DEFAULT_NEEDLE)
+    run.add_argument('--name', default='', help="Filename match")
+    run.add_argument('--no-csv', action='store_true', help="Leave CSV files out")
+    run.add_argument('--workers', default='1', help="Comma separated worker counts, e.g. 1,4")
+    run.add_argument('--repeat', type=int, default=1)
+    run.add_argument('--output', help="JSON file to write the results to (default: stdout)")
+
+    measure = commands.add_parser('measure')  # used by run_isolated
+    measure.add_argument('function', choices=[function.__name__ for function in MEASUREMENTS])
+    measure.add_argument('args', type=json.loads)
+
+    args = parser.parse_args(argv)
+    if args.command == 'measure':
+        function = next(function for function in MEASUREMENTS if function.__name__ == args.function)
+        print(json.dumps(function(*args.args)))
+        return 0
+    if args.command == 'generate':
+        summary = generate_corpus(args.target, args.files, args.mix, args.rows, args.cols, args.depth, args.fanout,
+                                  args.match_density, args.needle, args.shared_strings, args.encodings, args.seed)
+        print(json.dumps(summary, indent=2))
+        return 0
+
+    results = run_benchmark(args.corpus, args.needle, args.name, not args.no_csv,
+                            tuple(int(count) for count in args.workers.split(',')), args.repeat)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
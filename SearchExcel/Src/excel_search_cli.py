@@ -0,0 +1,131 @@
+"""
+Command line front end for ExcelSearcher, for scripted and display-less use.
+
+Example:
+    python excel_search_cli.py //server/share "PN-1234" --name "BOM" --recursive --csv --format jsonl
+    python excel_search_cli.py //server/share "PN-1234" --recursive --output results.xlsx
+"""
+import argparse
+import os
+import re
+import sys
+
+from excel_searcher import ExcelSearcher, ContentIndex, ListingCache, SearchQuery
+from excel_search_export import open_exporter
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Search Excel and CSV files for a text.")
+    parser.add_argument('path', help="Folder to search")
+    parser.add_argument('search_text', nargs='*', help="Text(s) to look for in the cells, a cell matches if it contains any of them")
+    parser.add_argument('--terms-file', help="File with additional search texts, one per line")
+    parser.add_argument('--regex', action='store_true', help="The search texts are regular expressions")
+    parser.add_argument('--whole-cell', action='store_true', help="A search text has to match the whole cell")
+    parser.add_argument('--case-sensitive', action='store_true', help="Match upper and lower case exactly")
+    parser.add_argument('--all-rows', action='store_true', help="Return every matching row instead of the first one per file")
+    parser.add_argument('--all-sheets', action='store_true', help="Search every sheet instead of only the active/first one")
+    parser.add_argument('-n', '--name', default='', help="Filename match, the file name must contain this (default: any)")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Search all subfolders")
+    parser.add_argument('--csv', action='store_true', help="Include CSV files")
+    parser.add_argument('-f', '--format', choices=('text', 'csv', 'jsonl', 'xlsx'), default=None,
+                        help="Output format, xlsx only with --output (default: from the --output extension, else text)")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="Write the matches to FILE as they are found instead of to the standard output")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="Number of worker processes (default: 1, which searches in this process unless --isolate or "
+                             "--timeout is given)")
+    parser.add_argument('--isolate', action='store_true',
+                        help="Search in a worker process even with one worker. In this process, a stop waits for the file "
+                             "being opened, which can take many seconds for a large .xlsx; a worker is interrupted right away")
+    parser.add_argument('--index', nargs='?', const='', default=None, metavar='DB',
+                        help="Use the content index, optionally at the given database path")
+    parser.add_argument('--listing-cache', nargs='?', const='', default=None, metavar='DB',
+                        help="Only list folders that changed since the last run, optionally caching the listings at the given database path")
+    parser.add_argument('--include-dir', action='append', default=[], metavar='GLOB',
+                        help="Only search the subfolders of the path matching this glob, can be repeated")
+    parser.add_argument('--exclude-dir', action='append', default=[], metavar='GLOB',
+                        help="Skip folders whose name or relative path matches this glob, can be repeated")
+    parser.add_argument('--max-depth', type=int, default=None, help="Deepest folder level searched with --recursive")
+    parser.add_argument('--csv-encoding', default=None, help="Encoding of CSV files (default: detect per file)")
+    parser.add_argument('--csv-delimiter', default=';', help="Delimiter of CSV files, empty to sniff it (default: ';')")
+    parser.add_argument('--no-dedupe', action='store_true', help="Search identical copies of a file separately")
+    parser.add_argument('--order', choices=('found', 'size', 'mtime', 'path'), default='found',
+                        help="Order files are searched in: as found, smallest first, newest first or by path (default: found)")
+    parser.add_argument('--max-size', type=float, default=None, metavar='MB', help="Size limit per file in MB")
+    parser.add_argument('--timeout', type=float, default=None, metavar='SECONDS', help="Time limit per file in seconds")
+    parser.add_argument('--over-budget', choices=('defer', 'skip'), default='defer',
+                        help="Search files over a limit last, without a time limit, or skip them (default: defer)")
+    parser.add_argument('--stats', metavar='FILE', help="Write per-file timings and a summary of the run as JSON to FILE")
+    parser.add_argument('--slowest', type=int, default=10, metavar='N',
+                        help="Number of slowest files listed in the --stats summary (default: 10)")
+    return parser.parse_intermixed_args(argv)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def write_matches(matches, output_format, out=sys.stdout):
+    """
+    Write each SearchMatch to out, a file path or a text stream, in the requested format as soon as it is found.
+    The matches written before an interruption are kept. Returns the number of matches.
+    """
+    options = {'header': False} if output_format == 'csv' and not isinstance(out, str) else {}
+    with open_exporter(out, output_format, **options) as exporter:
+        for match in matches:
+            exporter.write(match)  # Flushed, so each match shows right away
+        return exporter.count
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.isdir(args.path):
+        print(f"The specified directory does not exist: {args.path}", file=sys.stderr)
+        return 2
+
+    terms = list(args.search_text)
+    if args.terms_file:
+        with open(args.terms_file, encoding='utf-8') as terms_file:
+            terms += [line.strip() for line in terms_file if line.strip()]
+    if not terms:
+        print("No search text given", file=sys.stderr)
+        return 2
+    try:
+        query = SearchQuery(terms, regex=args.regex, whole_cell=args.whole_cell, case_sensitive=args.case_sensitive,
+                            all_rows=args.all_rows, all_sheets=args.all_sheets)
+    except (re.error, ValueError) as e:
+        print(f"Invalid search text: {e}", file=sys.stderr)
+        return 2
+
+    index = ContentIndex(args.index or None) if args.index is not None else None
+    listing_cache = ListingCache(args.listing_cache or None) if args.listing_cache is not None else None
+    searcher = ExcelSearcher(args.path, recursive=args.recursive, workers=args.workers, index=index,
+                             csv_encoding=args.csv_encoding, csv_delimiter=args.csv_delimiter or None,
+                             include_dirs=args.include_dir, exclude_dirs=args.exclude_dir, max_depth=args.max_depth,
+                             dedupe=not args.no_dedupe, order=None if args.order == 'found' else args.order,
+                             max_file_size=int(args.max_size * 1024 * 1024) if args.max_size else None,
+                             file_timeout=args.timeout, over_budget=args.over_budget, listing_cache=listing_cache,
+                             isolate=args.isolate)
+    output_format = args.format or (None if args.output else 'text')
+    if output_format == 'xlsx' and not args.output:
+        print("The xlsx format needs --output", file=sys.stderr)
+        return 2
+    matches = searcher.iter_matches(args.name, query, include_csv=args.csv)
+    try:
+        count = write_matches(matches, output_format, args.output or sys.stdout)
+    except KeyboardInterrupt:
+        matches.close()
+        return 130
+    except BrokenPipeError:
+        # The reader went away, e.g. head got its lines. Point stdout at devnull so the flush at exit doesn't fail again.
+        matches.close()
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 141
+    finally:
+        if args.stats:
+            searcher.stats.write_json(args.stats, top=args.slowest)
+
+    for file, reason in searcher.skipped_files:
+        print(f"Skipped {file}: {reason}", file=sys.stderr)
+    return 0 if count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
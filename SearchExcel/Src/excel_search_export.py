@@ -0,0 +1,188 @@
+"""
+Streaming export of search results: each SearchMatch is appended to the output as soon as it is found, so memory use
+doesn't grow with the number of results and the results found so far are on disk when a search is stopped or fails.
+
+Every record holds the file path, the sheet (empty for CSV files), the row number and the cell values of the row,
+with their types kept where the format allows it.
+
+Example:
+    with open_exporter('results.xlsx') as exporter:
+        for match in searcher.iter_matches('', query):
+            exporter.write(match)
+"""
+import csv
+import datetime
+import json
+import os
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'xlsx', 'text')
+XLSX_MAX_ROWS = 1048576  # Rows per worksheet, further results continue on a new sheet
+XLSX_MAX_COLUMNS = 16384  # Columns per worksheet, cells beyond it are left out
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def json_value(value):
+    """Return a JSON serializable form of a cell value: dates and times in ISO format, anything else unknown as text."""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def open_exporter(target, export_format=None, **kwargs):
+    """
+    Return the exporter for a file path or, except for xlsx, an open text stream.
+    The format is one of EXPORT_FORMATS, taken from the file extension if it isn't given.
+    """
+    if export_format is None:
+        extension = os.path.splitext(target)[1].lower().lstrip('.') if isinstance(target, str) else ''
+        export_format = {'txt': 'text', 'json': 'jsonl', 'ndjson': 'jsonl'}.get(extension, extension)
+    exporters = {'csv': CsvExporter, 'jsonl': JsonLinesExporter, 'xlsx': XlsxExporter, 'text': TextExporter}
+    if export_format not in exporters:
+        raise ValueError(f"Unknown export format {export_format!r}, use one of {', '.join(EXPORT_FORMATS)}")
+    return exporters[export_format](target, **kwargs)
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class TextExporter:
+    """
+    Writes the matches as text, a line with the file path and an indented line per matching row, for reading in an editor.
+    The target is a file path, which is created or overwritten, or an open text stream, which is left open.
+    Every match is flushed as it is written, so the output is complete up to the last match even while the search
+    is idle or after a crash.
+    """
+    def __init__(self, target):
+        self.own_file = isinstance(target, str)
+        self.file = open(target, 'w', newline='', encoding='utf-8') if self.own_file else target
+        self.count = 0  # Matches written
+        self.last_file = None
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def write(self, match):
+        self.write_record(match)
+        self.count += 1
+        self.flush()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def write_record(self, match):
+        if match.file != self.last_file:
+            self.file.write(f"{match.file}\n")
+            self.last_file = match.file
+        self.file.write(f"    {', '.join([str(cell) for cell in match.row])}\n")
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def flush(self):
+        self.file.flush()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        if self.own_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+class CsvExporter(TextExporter):
+    """
+    Writes a CSV row per match: file, sheet, row number and the cell values. Empty cells are written as empty fields.
+    With header, the first line names the columns.
+    """
+    def __init__(self, target, header=True, delimiter=','):
+        super().__init__(target)
+        self.writer = csv.writer(self.file, delimiter=delimiter)
+        if header:
+            self.writer.writerow(['file', 'sheet', 'row_number', 'values'])
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def write_record(self, match):
+        self.writer.writerow([match.file, match.sheet or '', match.row_number] + ['' if cell is None else cell for cell in match.row])
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+class JsonLinesExporter(TextExporter):
+    """
+    Writes a JSON object per line and match, with the file, sheet, row_number and row (the list of cell values).
+    Numbers, booleans and empty cells keep their JSON types, dates and times are written in ISO format.
+    """
+    def write_record(self, match):
+        self.file.write(json.dumps(match._asdict(), default=json_value, ensure_ascii=False) + '\n')
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+class XlsxExporter:
+    """
+    Writes a worksheet row per match with an openpyxl write-only workbook, which streams the rows to a temporary file
+    instead of keeping them in memory. Cell values keep their types. A worksheet that is full continues on a new one.
+
+    A workbook is only readable once it is saved by close(). Until then, every match is also written to a JSON Lines
+    journal next to it (the path + '.partial.jsonl'), which holds the results if the process dies before it is saved
+    and is removed after.
+    """
+    def __init__(self, target):
+        import openpyxl
+
+        if not isinstance(target, str):
+            raise ValueError("An xlsx export needs a file path")
+        self.path = target
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = None
+        self.sheet_rows = 0
+        self.count = 0  # Matches written
+        self.journal_path = target + '.partial.jsonl'
+        self.journal = JsonLinesExporter(self.journal_path)
+        self.closed = False
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _new_sheet(self):
+        sheet_number = len(self.workbook.worksheets) + 1
+        self.sheet = self.workbook.create_sheet("Results" if sheet_number == 1 else f"Results {sheet_number}")
+        self.sheet.append(['File', 'Sheet', 'Row', 'Values'])
+        self.sheet_rows = 1
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def cell_value(value):
+        """Return the value as the worksheet can hold it: characters not allowed in the XML removed from text."""
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        if isinstance(value, str):
+            return ILLEGAL_CHARACTERS_RE.sub('', value)
+        if isinstance(value, (int, float, bool, datetime.datetime, datetime.date, datetime.time)) or value is None:
+            return value
+        return str(value)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def write(self, match):
+        self.journal.write(match)
+        if self.sheet is None or self.sheet_rows >= XLSX_MAX_ROWS:
+            self._new_sheet()
+        cells = [match.file, match.sheet, match.row_number] + list(match.row)
+        self.sheet.append([self.cell_value(cell) for cell in cells[:XLSX_MAX_COLUMNS]])
+        self.sheet_rows += 1
+        self.count += 1
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        if self.closed:  # A write-only workbook can only be saved once
+            return
+        self.closed = True
+        if self.sheet is None:
+            self._new_sheet()  # An empty result still gets its header
+        self.journal.close()
+        self.workbook.save(self.path)
+        os.remove(self.journal_path)
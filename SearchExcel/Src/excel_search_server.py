@@ -0,0 +1,422 @@
+"""
+Search server: a long-running ExcelSearcher behind a small HTTP/JSON API, so several users searching the same share
+share one set of worker processes, one directory listing cache and one result cache instead of each parsing the
+same files and walking the same directories.
+
+Start it with:
+    python excel_search_server.py --workers 8 --max-searches 2 --index
+
+and point the GUI's "Server" field, or a RemoteSearcher, at http://127.0.0.1:8765. Paths are those seen by the server.
+
+API:
+    GET  /status   Returns the load of the server as JSON.
+    POST /search   Takes the search as a JSON object and streams the results as JSON Lines, one event per line:
+                   {"event": "queued"}                      waiting for a free search slot
+                   {"event": "progress", "path": ...}       folder or file being searched
+                   {"event": "match", "file": ..., "sheet": ..., "row_number": ..., "row": [...]}
+                   {"event": "file", ...}                   timing record of a finished file, see new_file_stats
+                   {"event": "heartbeat"}                   nothing new, sent so a gone client is noticed
+                   {"event": "done", "elapsed": ..., "skipped": [[file, reason], ...], ...}
+                   {"event": "error", "error": ...}
+                   Closing the connection stops the search.
+
+The search object has the path, terms and fname_match, and optionally recursive, include_csv, use_index, the
+SearchQuery options (regex, whole_cell, case_sensitive, all_rows, all_sheets) and the SEARCHER_OPTIONS.
+"""
+import argparse
+import codecs
+import http.server
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from excel_searcher import (ExcelSearcher, ContentIndex, ListingCache, ResultCache, SearchMatch, SearchQuery, SearchStats,
+                            SharedWorkerPool)
+
+DEFAULT_PORT = 8765
+HEARTBEAT_SECONDS = 0.5  # Longest silence on a search stream, so both sides notice when the other one is gone
+PROGRESS_SECONDS = 0.2  # Shortest interval between two progress events
+EVENT_QUEUE_SIZE = 1000  # Events buffered between a search and a slow client, the search waits when it is full
+
+QUERY_OPTIONS = ('regex', 'whole_cell', 'case_sensitive', 'all_rows', 'all_sheets')
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def _is_positive(value):
+    """True for an int or a finite float > 0. Bools are ints to Python, but not numbers to a JSON client."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 < value < float('inf')
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def _is_encoding(value):
+    try:
+        return isinstance(value, str) and codecs.lookup(value) is not None
+    except LookupError:
+        return False
+
+
+# ExcelSearcher arguments a client may set, with the check of their value and what it should be.
+# The workers, caches and index are the server's.
+SEARCHER_OPTIONS = {
+    'recursive': (lambda value: isinstance(value, bool), "true or false"),
+    'include_dirs': (lambda value: value is None or isinstance(value, list) and all(isinstance(v, str) for v in value),
+                     "a list of strings or null"),
+    'exclude_dirs': (lambda value: value is None or isinstance(value, list) and all(isinstance(v, str) for v in value),
+                     "a list of strings or null"),
+    'max_depth': (lambda value: value is None or isinstance(value, int) and not isinstance(value, bool) and value >= 0,
+                  "a whole number >= 0 or null"),
+    'csv_encoding': (lambda value: value is None or _is_encoding(value), "a known encoding or null"),
+    'csv_delimiter': (lambda value: value is None or isinstance(value, str) and len(value) == 1, "a single character or null"),
+    'order': (lambda value: value in (None, 'size', 'mtime', 'path'), "'size', 'mtime', 'path' or null"),
+    'max_file_size': (lambda value: value is None or _is_positive(value), "a number > 0 or null"),
+    'file_timeout': (lambda value: value is None or _is_positive(value), "a number > 0 or null"),
+    'over_budget': (lambda value: value in ('defer', 'skip'), "'defer' or 'skip'"),
+}
+
+
+class SearchServerError(Exception):
+    """A search was refused or failed on the server."""
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class SearchServer(http.server.ThreadingHTTPServer):
+    """
+    Serves searches from a thread per connection. At most max_searches run at the same time, further ones wait
+    up to queue_timeout seconds for a slot, so any number of users puts about the load of max_searches on the
+    file server. The running searches share the worker processes, the directory listings and the results per
+    file content, which stay warm between searches.
+
+    Args:
+        address (tuple): (host, port) to listen on.
+        workers (int): Number of worker processes shared by all searches.
+        max_searches (int): Number of searches running at the same time.
+        queue_timeout (float): Seconds a search waits for a slot before it is refused.
+        index (ContentIndex): Optional content index, used by searches asking for it.
+        listing_cache (ListingCache): Directory listing cache, a default one if None.
+        result_cache_mb (int): Memory budget of the result cache.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, max_searches=2, queue_timeout=300, index=None, listing_cache=None,
+                 result_cache_mb=256):
+        super().__init__(address, SearchRequestHandler)
+        self.worker_pool = SharedWorkerPool(workers or os.cpu_count() or 1)
+        self.max_searches = max(1, max_searches)
+        self.queue_timeout = queue_timeout
+        self.admission = threading.BoundedSemaphore(self.max_searches)
+        self.index = index
+        self.listing_cache = listing_cache or ListingCache()
+        self.result_cache = ResultCache(max_bytes=result_cache_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+        self.served = 0
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def new_search(self, request):
+        """
+        Return the (searcher, fname_match, query, include_csv) for a search request.
+        Raises ValueError (or re.error) for an invalid request.
+        """
+        if not isinstance(request, dict):
+            raise ValueError("The search must be a JSON object")
+        unknown = set(request) - {'path', 'terms', 'fname_match', 'include_csv', 'use_index', *QUERY_OPTIONS, *SEARCHER_OPTIONS}
+        if unknown:
+            raise ValueError(f"Unknown search option(s): {', '.join(sorted(unknown))}")
+        path = request.get('path')
+        if not isinstance(path, str) or not os.path.isdir(path):
+            raise ValueError(f"The specified directory does not exist: {path}")
+        terms = request.get('terms') or []
+        if not isinstance(terms, (str, list)) or not all(isinstance(term, str) for term in terms):
+            raise ValueError("terms must be a string or a list of strings")
+        if not isinstance(request.get('fname_match') or '', str):
+            raise ValueError("fname_match must be a string")
+        for name, (is_valid, expected) in SEARCHER_OPTIONS.items():
+            if name in request and not is_valid(request[name]):
+                raise ValueError(f"{name} must be {expected}, not {json.dumps(request[name])}")
+        query = SearchQuery(terms, **{name: bool(request[name]) for name in QUERY_OPTIONS if name in request})
+        index = self.index if request.get('use_index') else None
+        searcher = ExcelSearcher(path, index=index, result_cache=self.result_cache, listing_cache=self.listing_cache,
+                                 worker_pool=self.worker_pool, **{name: request[name] for name in SEARCHER_OPTIONS if name in request})
+        return searcher, request.get('fname_match') or '', query, bool(request.get('include_csv'))
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def status(self):
+        with self.lock:
+            status = {'running': self.running, 'queued': self.queued, 'served': self.served, 'max_searches': self.max_searches}
+        status.update({
+            'workers': self.worker_pool.pool.size,
+            'busy_workers': self.worker_pool.busy_workers(),
+            'index': self.index.db_path if self.index is not None else None,
+            'result_cache_bytes': self.result_cache.used_bytes,
+            'listing_cache_hits': self.listing_cache.hits,
+            'listing_cache_misses': self.listing_cache.misses,
+        })
+        return status
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def admit(self, on_wait):
+        """
+        Wait up to queue_timeout seconds for a search slot, calling on_wait every HEARTBEAT_SECONDS while waiting.
+        Returns True once a slot is taken, which must be given back with release(), or False on timeout.
+        """
+        with self.lock:
+            self.queued += 1
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while not self.admission.acquire(timeout=HEARTBEAT_SECONDS):
+                if time.monotonic() >= deadline:
+                    return False
+                on_wait()
+        finally:
+            with self.lock:
+                self.queued -= 1
+        with self.lock:
+            self.running += 1
+        return True
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def release(self):
+        with self.lock:
+            self.running -= 1
+            self.served += 1
+        self.admission.release()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def server_close(self):
+        super().server_close()
+        self.worker_pool.close()
+        self.listing_cache.save()
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class SearchRequestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = 'ExcelSearchServer/1.0'
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def write_event(self, event):
+        self.wfile.write((json.dumps(event, default=str, ensure_ascii=False) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        self.send_json(200, self.server.status())
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def do_POST(self):
+        if self.path != '/search':
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            search = self.server.new_search(json.loads(self.rfile.read(length) or b'null'))
+        except (ValueError, TypeError, re.error) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            self.stream_search(*search)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped the search
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def stream_search(self, searcher, fname_match, query, include_csv):
+        """
+        Run the search in a thread of its own once a slot is free, and write its events to the client as they come.
+        The search thread hands the events over through a bounded queue, so a slow client holds the search up instead
+        of filling the memory, and a gone client is noticed at the next heartbeat, which stops the search.
+        """
+        server = self.server
+        # Writing raises once the client is gone, which ends the wait
+        if not server.admit(lambda: self.write_event({'event': 'queued'})):
+            self.write_event({'event': 'error', 'error': f"The server is busy, no search slot freed up within {server.queue_timeout} s"})
+            return
+
+        events = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        closed = threading.Event()  # Set when nobody takes events anymore
+        progress = [None]
+
+        def emit(event):
+            while not closed.is_set():
+                try:
+                    events.put(event, timeout=HEARTBEAT_SECONDS)
+                    return
+                except queue.Full:
+                    pass
+
+        def report_progress(path):
+            progress[0] = path
+
+        def search():
+            try:
+                for match in searcher.iter_matches(fname_match, query, report_progress, include_csv):
+                    emit(dict(match._asdict(), event='match'))
+                stats = searcher.stats
+                emit({'event': 'done', 'elapsed': stats.elapsed, 'walk_seconds': stats.walk_seconds,
+                      'directories': stats.directories, 'skipped_directories': stats.skipped_directories,
+                      'skipped': searcher.skipped_files})
+            except Exception as e:
+                emit({'event': 'error', 'error': f"{type(e).__name__}: {e}"})
+            finally:
+                server.release()
+
+        searcher.profile_callback = lambda file_stats: emit(dict(file_stats, event='file'))
+        thread = threading.Thread(target=search, daemon=True)
+        thread.start()
+        try:
+            sent_progress, progress_time = None, 0
+            while True:
+                try:
+                    event = events.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    event = None
+                if progress[0] != sent_progress and time.monotonic() - progress_time >= PROGRESS_SECONDS:
+                    sent_progress, progress_time = progress[0], time.monotonic()
+                    self.write_event({'event': 'progress', 'path': sent_progress})
+                elif event is None:
+                    self.write_event({'event': 'heartbeat'})
+                if event is not None:
+                    self.write_event(event)
+                    if event['event'] in ('done', 'error'):
+                        break
+        finally:
+            closed.set()
+            searcher.stop_search()
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class RemoteSearcher:
+    """
+    Runs searches on a search server, with the part of the ExcelSearcher interface the front ends use:
+    iter_matches, stop_search, skipped_files and stats (rebuilt from the timing records the server sends).
+
+    Args:
+        server_url (str): Address of the server, e.g. 'http://127.0.0.1:8765'.
+        base_folder (str): The folder to search, as seen by the server.
+        use_index (bool): Let the server answer unchanged files from its content index, if it has one.
+        **options: ExcelSearcher arguments passed on to the server, see SEARCHER_OPTIONS.
+    """
+    def __init__(self, server_url, base_folder, use_index=False, **options):
+        self.server_url = server_url.rstrip('/')
+        self.base_folder = base_folder
+        self.use_index = use_index
+        self.options = options
+        self.searching = False
+        self.skipped_files = []
+        self.stats = SearchStats()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def status(self):
+        """Return the load of the server."""
+        with urllib.request.urlopen(self.server_url + '/status', timeout=10) as response:
+            return json.load(response)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def iter_matches(self, fname_match, search_text, progress_callback=None, include_csv=False):
+        """
+        Yields a SearchMatch for every matching row as the server finds it, like ExcelSearcher.iter_matches.
+        Raises SearchServerError if the server refuses or fails the search, and OSError if it can't be reached.
+        """
+        query = SearchQuery.of(search_text)
+        search = {'path': self.base_folder, 'terms': query.terms, 'fname_match': fname_match, 'include_csv': include_csv,
+                  'use_index': self.use_index, **{name: getattr(query, name) for name in QUERY_OPTIONS}, **self.options}
+        request = urllib.request.Request(self.server_url + '/search', data=json.dumps(search).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        self.searching = True
+        self.skipped_files = []
+        self.stats = SearchStats()
+        try:
+            try:
+                response = urllib.request.urlopen(request, timeout=30)
+            except urllib.error.HTTPError as e:
+                raise SearchServerError(json.load(e).get('error', str(e))) from None
+            with response:
+                # The server writes at least a heartbeat every HEARTBEAT_SECONDS, so a stop is noticed in time
+                for line in response:
+                    if not self.searching:
+                        break
+                    event = json.loads(line)
+                    kind = event.pop('event')
+                    if kind == 'match':
+                        yield SearchMatch(**event)
+                    elif kind == 'progress':
+                        if progress_callback and event['path']:
+                            progress_callback(event['path'])
+                    elif kind == 'file':
+                        self.stats.add_file(event)
+                    elif kind == 'done':
+                        self.skipped_files = [tuple(skipped) for skipped in event.pop('skipped')]
+                        for name, value in event.items():
+                            setattr(self.stats, name, value)
+                        break
+                    elif kind == 'error':
+                        raise SearchServerError(event['error'])
+        finally:
+            self.searching = False
+            if self.stats.elapsed is None:
+                self.stats.finish()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def stop_search(self):
+        self.searching = False
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Excel searches to several clients from one warm engine.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1, this machine only)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes shared by all searches (default: number of CPUs)")
+    parser.add_argument('--max-searches', type=int, default=2, help="Number of searches running at the same time (default: 2)")
+    parser.add_argument('--queue-timeout', type=float, default=300, metavar='SECONDS',
+                        help="Seconds a search waits for a free slot before it is refused (default: 300)")
+    parser.add_argument('--index', nargs='?', const='', default=None, metavar='DB',
+                        help="Answer searches asking for it from the content index, optionally at the given database path")
+    parser.add_argument('--listing-cache', default=None, metavar='DB', help="Database path of the directory listing cache")
+    parser.add_argument('--result-cache-mb', type=int, default=256, help="Memory budget of the result cache in MB (default: 256)")
+    return parser.parse_args(argv)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def main(argv=None):
+    args = parse_args(argv)
+    index = ContentIndex(args.index or None) if args.index is not None else None
+    server = SearchServer((args.host, args.port), workers=args.workers, max_searches=args.max_searches,
+                          queue_timeout=args.queue_timeout, index=index, listing_cache=ListingCache(args.listing_cache),
+                          result_cache_mb=args.result_cache_mb)
+    print(f"Serving searches on http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
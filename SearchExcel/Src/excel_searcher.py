@@ -0,0 +1,2248 @@
+import os
+import fnmatch
+import threading
+import csv
+import concurrent.futures
+import sqlite3
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+import mmap
+import codecs
+import re
+import queue
+import time
+import json
+import datetime
+import hashlib
+import heapq
+import itertools
+import signal
+import sys
+import multiprocessing
+import multiprocessing.connection
+from collections import namedtuple, OrderedDict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# openpyxl, xlrd and chardet are imported where they are first needed, so importing the engine stays cheap
+# and a search only pays for the parsers of the formats it actually opens
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xltx', '.xlsm', '.xls')
+
+# Characters of the text openpyxl produces for numbers, dates and times, which the XML pre-check can't rule out
+XLSX_NUMERIC_CHARS = set('0123456789.,-+e: ')
+
+CSV_SAMPLE_SIZE = 64 * 1024  # Bytes read for encoding detection and delimiter sniffing
+CSV_CHUNK_SIZE = 4 * 1024 * 1024  # Bytes scanned at a time by the byte-level CSV search
+CSV_DELIMITERS = ';,\t|'  # Candidates when the CSV delimiter is sniffed
+CSV_BARE_CR = re.compile(rb'\r(?!\n)')  # A carriage return ending a row on its own, as in classic Mac line endings
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read at a time when hashing file contents
+INDEX_BATCH_ROWS = 1000  # Rows written to the content index per transaction while a file is parsed
+SCHEDULED_AHEAD = 32  # Files the scheduling thread walks, orders and hashes ahead of the workers
+
+# A matching row: the file, the sheet name (None for CSV files), the 1-based row number and the cell values
+SearchMatch = namedtuple('SearchMatch', ['file', 'sheet', 'row_number', 'row'])
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def compile_fname_matcher(fname_match, include_csv=False):
+    """
+    Compiles the filename match and the supported extensions into a single regular expression.
+
+    Args:
+        fname_match (str): Text or glob the file name has to contain.
+        include_csv (bool): Also match CSV files.
+
+    Returns:
+        callable: Returns a truthy value for file names that should be searched.
+    """
+    extensions = EXCEL_EXTENSIONS + (('.csv',) if include_csv else ())
+    pattern = '|'.join(f'(?:{fnmatch.translate(f"*{fname_match}*{extension}")})' for extension in extensions)
+    # fnmatch ignores case on Windows, keep doing the same there
+    return re.compile(pattern, re.IGNORECASE if os.name == 'nt' else 0).match
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def compile_globs(patterns):
+    """Compiles a list of glob patterns into a single matcher, or returns None for an empty list."""
+    if not patterns:
+        return None
+    pattern = '|'.join(f'(?:{fnmatch.translate(glob)})' for glob in patterns)
+    return re.compile(pattern, re.IGNORECASE if os.name == 'nt' else 0).match
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def compile_literals(needles):
+    """Return a function telling whether a text contains any of the needles, using a single pattern for several needles."""
+    if len(needles) == 1:
+        needle = needles[0]
+        return lambda text: needle in text
+    search = re.compile('|'.join(re.escape(needle) for needle in dict.fromkeys(needles))).search
+    return lambda text: search(text) is not None
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class SearchQuery:
+    """
+    A search prepared once and then applied to every cell: one or more terms compiled into a single matcher,
+    and the options deciding which cells match and which rows are returned.
+
+    Args:
+        terms (str or list): The text(s) to look for. A cell matches if it matches any of them.
+        regex (bool): The terms are regular expressions instead of plain text.
+        whole_cell (bool): A term has to match the whole cell text instead of a part of it.
+        case_sensitive (bool): Match upper and lower case exactly.
+        all_rows (bool): Return every matching row of a file instead of only the first one.
+        all_sheets (bool): Search every sheet of a workbook instead of only the active/first one.
+    """
+    def __init__(self, terms, regex=False, whole_cell=False, case_sensitive=False, all_rows=False, all_sheets=False):
+        if isinstance(terms, str):
+            terms = [terms]
+        self.terms = [term for term in terms if term]
+        if not self.terms:
+            raise ValueError("No search text given")
+        self.regex = regex
+        self.whole_cell = whole_cell
+        self.case_sensitive = case_sensitive
+        self.all_rows = all_rows
+        self.all_sheets = all_sheets
+        self.cell_matches = self._compile()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def of(cls, search):
+        """Return search itself if it already is a SearchQuery, otherwise a default query for the given text(s)."""
+        return search if isinstance(search, cls) else cls(search)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _compile(self):
+        fold = (lambda text: text) if self.case_sensitive else str.lower
+        if self.regex:
+            pattern = re.compile('|'.join(f'(?:{term})' for term in self.terms), 0 if self.case_sensitive else re.IGNORECASE)
+            test = pattern.fullmatch if self.whole_cell else pattern.search
+            return lambda text: test(text) is not None
+        terms = [fold(term) for term in self.terms]
+        if self.whole_cell:
+            term_set = set(terms)
+            return lambda text: fold(text) in term_set
+        contains = compile_literals(terms)
+        return lambda text: contains(fold(text))
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def __getstate__(self):
+        # The compiled matcher is a closure, rebuild it instead of pickling it for worker processes
+        state = self.__dict__.copy()
+        del state['cell_matches']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cell_matches = self._compile()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def row_matches(self, row):
+        """Return True if any non-empty cell of the row matches."""
+        cell_matches = self.cell_matches
+        for value in row:
+            if value and cell_matches(str(value)):
+                return True
+        return False
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def literal_needles(self):
+        """
+        Return the lowercased terms that any matching cell must contain, for the pre-filters and the content index,
+        or None if matches can't be narrowed down by plain text.
+        """
+        if self.regex:
+            return None
+        return [term.lower() for term in self.terms]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def key(self):
+        """Return a hashable key that is equal for queries matching the same rows."""
+        return (tuple(self.terms), self.regex, self.whole_cell, self.case_sensitive, self.all_rows, self.all_sheets)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def detect_encoding(file_path, sample_size=CSV_SAMPLE_SIZE):
+    """
+    Detects the encoding of a text file from a bounded sample at the start of the file.
+
+    Args:
+        file_path (str): The file to inspect.
+        sample_size (int): The number of bytes given to chardet.
+
+    Returns:
+        str: The detected encoding. Plain ASCII samples are reported as UTF-8, which also decodes the rest of the file.
+    """
+    import chardet
+
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    encoding = chardet.detect(sample)['encoding']
+    if not encoding or encoding.lower() == 'ascii':
+        return 'utf-8'
+    return encoding
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def user_data_dir():
+    """
+    Return the folder for the databases kept across sessions, created if needed: under LOCALAPPDATA on Windows,
+    XDG_CACHE_HOME or ~/.cache elsewhere. Unlike the shared temp folder, other users can't read or plant files there.
+    """
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'excel_search')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def content_hash(file_path, chunk_size=HASH_CHUNK_SIZE, running=None):
+    """
+    Return the BLAKE2b hex digest of a file's content, read in chunks.
+    running is an optional function called between chunks; once it returns False, hashing stops and None is returned.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            if running is not None and not running():
+                return None
+            digest.update(chunk)
+    return digest.hexdigest()
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def find_in_bytes(data, needles, start=0, chunk_size=CSV_CHUNK_SIZE):
+    """
+    Finds the first of one or more ASCII-lowercased byte strings in a buffer, such as a memory-mapped file,
+    lowercasing it chunk by chunk. Several needles are combined into one pattern, so the buffer is read once.
+
+    Args:
+        data (bytes or mmap.mmap): The buffer to search.
+        needles (bytes or list): The text(s) to look for, lowercased. Matching ignores the case of ASCII letters only.
+        start (int): The offset to start searching from.
+        chunk_size (int): The number of bytes lowercased at a time.
+
+    Returns:
+        int: The offset of the first match, or -1 if there is none.
+    """
+    if isinstance(needles, bytes):
+        needles = [needles]
+    if len(needles) == 1:
+        needle = needles[0]
+
+        def find(chunk):
+            return chunk.find(needle)
+    else:
+        pattern = re.compile(b'|'.join(re.escape(needle) for needle in needles))
+
+        def find(chunk):
+            found = pattern.search(chunk)
+            return found.start() if found else -1
+
+    overlap = max(len(needle) for needle in needles) - 1
+    position = start
+    while position < len(data):
+        chunk = data[position:position + chunk_size + overlap].lower()
+        found = find(chunk)
+        if found != -1:
+            return position + found
+        position += chunk_size
+    return -1
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def count_lines(data, start, end, chunk_size=CSV_CHUNK_SIZE):
+    """Count the newlines in data[start:end] without copying more than chunk_size bytes at a time."""
+    lines = 0
+    for position in range(start, end, chunk_size):
+        lines += data[position:min(position + chunk_size, end)].count(b'\n')
+    return lines
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def csv_byte_searchable(needles):
+    """
+    Return True if the lowercased needles can be searched for in the raw bytes of a CSV file: byte-level case
+    folding only works for ASCII, and quotes and line breaks in a needle need the CSV parser.
+    """
+    return all(needle.isascii() and '"' not in needle and '\n' not in needle and '\r' not in needle for needle in needles)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def _xlsx_relationships(archive, part):
+    """Return (type, part name) for each relationship of a part in an xlsx package, with the targets resolved."""
+    folder, name = posixpath.split(part)
+    rels_name = posixpath.join(folder, '_rels', name + '.rels')
+    with archive.open(rels_name) as xml_file:
+        root = ET.parse(xml_file).getroot()
+    relationships = []
+    for relationship in root:
+        if relationship.get('TargetMode') == 'External':
+            continue
+        target = relationship.get('Target', '')
+        target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(folder, target))
+        relationships.append((relationship.get('Type', ''), target))
+    return relationships
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def xlsx_parts(archive):
+    """
+    Return the (shared strings part or None, worksheet parts) of an xlsx package, found through the package and
+    workbook relationships like openpyxl does, so parts with unusual names aren't missed.
+    """
+    workbook = next((target for rel_type, target in _xlsx_relationships(archive, '')
+                     if rel_type.endswith('/officeDocument')), None)
+    if workbook is None:
+        raise KeyError("No workbook part")
+    shared_strings, worksheets = None, []
+    for rel_type, target in _xlsx_relationships(archive, workbook):
+        if rel_type.endswith('/sharedStrings'):
+            shared_strings = target
+        elif rel_type.endswith('/worksheet'):
+            worksheets.append(target)
+    return shared_strings, worksheets
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def xlsx_may_contain(file_path, needles):
+    """
+    Cheap pre-check that reads the XML inside an .xlsx/.xlsm/.xltx package directly, without building a workbook.
+
+    The shared strings are checked first, then the inline strings, formulas and other text values of the sheets.
+    The parts are located through the package relationships. The check errs on the side of caution: needles that
+    could match a number or a date as openpyxl renders it, sheets using shared strings that couldn't be read, and
+    files that can't be read this way, are always reported as possible matches.
+
+    Args:
+        file_path (str): The workbook to check.
+        needles (str or list): The lowercased text(s) to look for.
+
+    Returns:
+        bool: False if the workbook can't contain any needle, True if it has to be searched with the real parser.
+    """
+    if isinstance(needles, str):
+        needles = [needles]
+    if not needles or any(not needle or all(char in XLSX_NUMERIC_CHARS for char in needle) for needle in needles):
+        return True
+    contains = compile_literals(needles)
+
+    def local_name(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            shared_strings, worksheets = xlsx_parts(archive)
+            if shared_strings is not None:
+                with archive.open(shared_strings) as xml_file:
+                    for _, element in ET.iterparse(xml_file):
+                        if local_name(element.tag) == 'si':
+                            # Rich text is split over several runs, each with its own <t>
+                            text = ''.join(t.text or '' for t in element.iter() if local_name(t.tag) == 't')
+                            if contains(text.lower()):
+                                return True
+                            element.clear()
+
+            for name in worksheets:
+                with archive.open(name) as xml_file:
+                    for _, element in ET.iterparse(xml_file):
+                        tag = local_name(element.tag)
+                        if tag == 'row':
+                            element.clear()
+                        if tag != 'c':
+                            continue
+                        cell_type = element.get('t')
+                        if cell_type == 's' and shared_strings is None:
+                            return True  # Refers to shared strings that weren't found, let openpyxl have a look
+                        for child in element:
+                            child_tag = local_name(child.tag)
+                            if child_tag == 'f':
+                                if not child.text:
+                                    return True  # Shared formula, openpyxl translates the master formula for this cell
+                                if contains(('=' + child.text).lower()):
+                                    return True
+                            elif child_tag == 'is':
+                                text = ''.join(t.text or '' for t in child.iter() if local_name(t.tag) == 't')
+                                if contains(text.lower()):
+                                    return True
+                            elif child_tag == 'v' and child.text:
+                                if cell_type in ('str', 'e') and contains(child.text.lower()):
+                                    return True
+                                if cell_type == 'b' and contains('true' if child.text == '1' else 'false'):
+                                    return True
+                        element.clear()
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, OSError):
+        return True  # Let the real parser report the problem
+    return False
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def new_file_stats(file_path):
+    """
+    Return an empty timing record for one file, filled in while the file is searched.
+
+    The stages are seconds spent in the xlsx/CSV pre-filter, in detecting the CSV encoding and delimiter, in opening
+    the file (loading the workbook), in reading rows, in matching them and in hashing the content for deduplication.
+    The status is 'searched', 'prefiltered' (ruled out from the raw content), 'indexed' (answered from the content
+    index), 'duplicate' (a copy of a file searched in the same run), 'cached' (answered from the ResultCache),
+    'skipped' (larger than the size limit), 'timeout' (ran over the time limit), 'stopped' (the search was stopped
+    before the end of the file, so its matches may be incomplete) or 'error'. bytes is the file size, rows the number
+    of rows read and digest the content hash, if it was needed. pid and peak_rss are the process that searched the file
+    and its peak resident set size in bytes so far, see peak_rss_bytes().
+    """
+    return {
+        'file': file_path,
+        'format': os.path.splitext(file_path)[1].lower().lstrip('.') if file_path else None,
+        'parser': None,
+        'status': 'searched',
+        'error': None,
+        'seconds': 0.0,
+        'prefilter': 0.0,
+        'detect': 0.0,
+        'open': 0.0,
+        'parse': 0.0,
+        'scan': 0.0,
+        'hash': 0.0,
+        'digest': None,
+        'bytes': 0,
+        'rows': 0,
+        'matches': 0,
+        'pid': None,
+        'peak_rss': None,
+    }
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def peak_rss_bytes():
+    """Return the peak resident set size of this process in bytes, or None where it can't be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class SearchStats:
+    """
+    Timings of one search or index run: a record per file as returned by new_file_stats, the time spent
+    listing directories and the counts of files per status, summarized into the slowest files and the
+    throughput per format.
+    """
+    STAGES = ('prefilter', 'detect', 'open', 'parse', 'scan', 'hash')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.elapsed = None  # Seconds from the start to finish(), None while running
+        self.walk_seconds = None  # Seconds until every directory was listed, None if the walk didn't complete
+        self.directories = 0
+        self.skipped_directories = 0
+        self.files = []
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def add_file(self, file_stats):
+        self.files.append(file_stats)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def counters(self):
+        """Return the number of files per status."""
+        counts = {'searched': 0, 'prefiltered': 0, 'indexed': 0, 'duplicate': 0, 'cached': 0, 'skipped': 0, 'timeout': 0,
+                  'stopped': 0, 'error': 0}
+        for file_stats in self.files:
+            counts[file_stats['status']] = counts.get(file_stats['status'], 0) + 1
+        return counts
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def slowest(self, count=10):
+        """Return the records of the count files that took longest."""
+        return sorted(self.files, key=lambda file_stats: file_stats['seconds'], reverse=True)[:count]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def per_format(self):
+        """Return the totals and the throughput per file format."""
+        formats = {}
+        for file_stats in self.files:
+            totals = formats.setdefault(file_stats['format'], {'files': 0, 'bytes': 0, 'rows': 0, 'matches': 0, 'errors': 0,
+                                                               'seconds': 0.0, **dict.fromkeys(self.STAGES, 0.0)})
+            for stage in self.STAGES:
+                totals[stage] += file_stats[stage]
+            totals['files'] += 1
+            totals['bytes'] += file_stats['bytes']
+            totals['rows'] += file_stats['rows']
+            totals['matches'] += file_stats['matches']
+            totals['errors'] += file_stats['status'] == 'error'
+            totals['seconds'] += file_stats['seconds']
+        for totals in formats.values():
+            seconds = totals['seconds']
+            totals['files_per_second'] = totals['files'] / seconds if seconds else None
+            totals['mb_per_second'] = totals['bytes'] / 1e6 / seconds if seconds else None
+        return formats
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def summary(self, top=10):
+        """Return the end-of-run summary as a dict: totals, counters, throughput per format and the top slowest files."""
+        return {
+            'elapsed': self.elapsed if self.elapsed is not None else time.perf_counter() - self.started,
+            'walk_seconds': self.walk_seconds,
+            'directories': self.directories,
+            'skipped_directories': self.skipped_directories,
+            'files': len(self.files),
+            'counters': self.counters(),
+            'stages': {stage: sum(file_stats[stage] for file_stats in self.files) for stage in self.STAGES},
+            'per_format': self.per_format(),
+            'slowest': self.slowest(top),
+        }
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def write_json(self, file_path, top=10):
+        """Write the summary and every file record to a JSON file."""
+        data = self.summary(top)
+        data['file_stats'] = self.files
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class ResultCache:
+    """
+    Search results per file content, kept across the searches of a session, so a file whose content was already
+    searched the same way isn't parsed again, whatever its path.
+
+    Results are keyed by the content hash and the search, and the least recently used ones are evicted once their
+    estimated size exceeds max_bytes. The hashes of the last max_paths paths are remembered with their size and
+    modification time, so unchanged files don't have to be read again to be looked up. It can be shared by
+    searches running in several threads.
+
+    Args:
+        max_bytes (int): Memory budget for the cached results.
+        max_paths (int): Number of path hashes remembered.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_paths=100000):
+        self.max_bytes = max_bytes
+        self.max_paths = max_paths
+        self.used_bytes = 0
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # (digest, search key) -> (result, estimated bytes), least recently used first
+        self._digests = OrderedDict()  # path -> (size, mtime_ns, digest)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def estimate_size(result):
+        """Roughly estimate the memory used by a list of SearchMatch records."""
+        size = 64
+        for match in result:
+            size += 200 + len(match.file) + sum(56 + len(str(cell)) for cell in match.row)
+        return size
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def known_digest(self, file_path, stat):
+        """Return the remembered content hash of a file if it is unchanged since it was hashed, otherwise None."""
+        with self._lock:
+            known = self._digests.get(file_path)
+            if known is None or known[:2] != (stat.st_size, stat.st_mtime_ns):
+                return None
+            self._digests.move_to_end(file_path)
+            return known[2]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def remember_digest(self, file_path, stat, digest):
+        with self._lock:
+            self._digests[file_path] = (stat.st_size, stat.st_mtime_ns, digest)
+            self._digests.move_to_end(file_path)
+            while len(self._digests) > self.max_paths:
+                self._digests.popitem(last=False)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def get(self, digest, search_key):
+        """Return the cached result for a content and search, or None."""
+        with self._lock:
+            entry = self._results.get((digest, search_key))
+            if entry is None:
+                return None
+            self._results.move_to_end((digest, search_key))
+            return entry[0]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def put(self, digest, search_key, result):
+        """Cache a result, evicting the least recently used ones to stay within the memory budget."""
+        key = (digest, search_key)
+        size = self.estimate_size(result)
+        with self._lock:
+            if key in self._results:
+                self.used_bytes -= self._results.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._results[key] = (result, size)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, (_, evicted) = self._results.popitem(last=False)
+                self.used_bytes -= evicted
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._digests.clear()
+            self.used_bytes = 0
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class _Deduplicator:
+    """
+    Groups the files of one search by size and then by content hash, so each distinct content is searched once
+    and its result is handed to every path with that content.
+
+    A file is only hashed here once a second file of the same size shows up. With a ResultCache, files are also
+    hashed after they were searched, by the worker while the file is still in the OS cache, so later searches
+    can look them up.
+
+    admit() and finished() can be called from different threads. Files are hashed outside the lock, so a
+    finished file can be recorded while another one is being hashed.
+    """
+    def __init__(self, search_key, cache=None, running=None):
+        self.search_key = search_key
+        self.cache = cache
+        self.running = running  # Function returning False once the search is stopped, checked while hashing
+        self._lock = threading.Lock()
+        self.first_of_size = {}  # size -> (file, stat) of the first file seen with that size
+        self.stats = {}  # file -> os.stat result of the files being searched
+        self.digests = {}  # file -> content hash, of the files hashed in this search
+        self.unhashed = {}  # file -> result of the searched files whose content wasn't hashed, in case a copy shows up
+        self.contents = {}  # digest -> ('done', result) or ('running', [(position, file, file_stats) waiting for it])
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _digest(self, file, stat, file_stats):
+        with self._lock:
+            digest = self.digests.get(file)
+        if digest is None and self.cache is not None:
+            digest = self.cache.known_digest(file, stat)
+        if digest is None:
+            started = time.perf_counter()
+            digest = content_hash(file, running=self.running)
+            file_stats['hash'] += time.perf_counter() - started
+            if digest is None:  # Stopped
+                return None
+            if self.cache is not None:
+                self.cache.remember_digest(file, stat, digest)
+        with self._lock:
+            self.digests[file] = digest
+        return digest
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _adopt(self, first_file, first_digest):
+        """Register the content of the first file of a size once another one of that size shows up. Needs the lock."""
+        if first_digest not in self.contents:
+            if first_file in self.unhashed:
+                self._store(first_digest, self.unhashed.pop(first_file))
+            elif first_file in self.stats:  # Still being searched
+                self.contents[first_digest] = ('running', [])
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _store(self, digest, result):
+        self.contents[digest] = ('done', result)
+        if self.cache is not None:
+            self.cache.put(digest, self.search_key, result)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def admit(self, position, file, stat=None):
+        """
+        Decide how a file is handled before it is searched.
+
+        Returns:
+            tuple: (action, file_stats) where action is 'search' if the file has to be searched, 'done' if its result
+                is already known (see result()), or 'wait' if a file with the same content is being searched, in which
+                case finished() returns it with that file's result. file_stats has the time spent hashing and the
+                content hash, if it is known. stat is the os.stat result of the file, if it is already known.
+        """
+        file_stats = new_file_stats(file)
+        try:
+            stat = stat or os.stat(file)
+            file_stats['bytes'] = stat.st_size
+            with self._lock:
+                first = self.first_of_size.setdefault(stat.st_size, (file, stat))
+            digest = self.cache.known_digest(file, stat) if self.cache is not None else None
+            if digest is None and first[0] == file:
+                with self._lock:
+                    self.stats[file] = stat
+                return 'search', file_stats
+            # Once a second file of a size shows up, the first one is hashed too
+            first_digest = self._digest(first[0], first[1], file_stats) if first[0] != file else None
+            digest = digest or self._digest(file, stat, file_stats)
+        except OSError:
+            return 'search', file_stats  # Let the search report the problem
+        if digest is None:  # The search was stopped while hashing
+            return 'search', file_stats
+        file_stats['digest'] = digest
+        file_stats['seconds'] = file_stats['hash']
+        with self._lock:
+            if first_digest is not None:
+                self._adopt(first[0], first_digest)
+            self.digests[file] = digest
+            content = self.contents.get(digest)
+            if content is None:
+                result = self.cache.get(digest, self.search_key) if self.cache is not None else None
+                if result is None:
+                    self.contents[digest] = ('running', [])
+                    self.stats[file] = stat
+                    return 'search', file_stats
+                content = self.contents[digest] = ('done', result)
+                file_stats['status'] = 'cached'
+            elif content[0] == 'running':
+                content[1].append((position, file, file_stats))
+                return 'wait', file_stats
+            else:
+                file_stats['status'] = 'duplicate'
+        file_stats['matches'] = len(content[1])
+        return 'done', file_stats
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def result(self, file, result=None):
+        """Return the result found for the content of a file, as the result of that file."""
+        if result is None:
+            with self._lock:
+                result = self.contents[self.digests[file]][1]
+        return [match._replace(file=file) for match in result]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def finished(self, file, result, file_stats):
+        """
+        Record the result of a searched file, None if the search failed or was stopped before the end of the file.
+
+        Returns:
+            list: The (position, file, file_stats) of the copies that waited for this file. If the search failed
+                or was stopped, they get the same status.
+        """
+        with self._lock:
+            stat = self.stats.pop(file, None)
+            digest = self.digests.get(file) or file_stats['digest']
+            if digest is None:
+                if result is not None:
+                    self.unhashed[file] = result
+                return []
+            self.digests[file] = digest
+            content = self.contents.get(digest)
+            waiting = content[1] if content is not None and content[0] == 'running' else []
+            if result is None:
+                if content is not None and content[0] == 'running':
+                    del self.contents[digest]
+            else:
+                self._store(digest, result)
+        if self.cache is not None and stat is not None:
+            self.cache.remember_digest(file, stat, digest)
+        for _, _, copy_stats in waiting:
+            if result is None:
+                copy_stats.update(status=file_stats['status'], error=file_stats['error'])
+            else:
+                copy_stats.update(status='duplicate', matches=len(result))
+        return waiting
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class ContentIndex:
+    """
+    Persistent SQLite index of the cell text of searched files, keyed by path, size and modification time.
+
+    Files whose size and mtime are unchanged since they were indexed are answered from the index, so only
+    new or modified files have to be parsed again. When the SQLite build supports the FTS5 trigram tokenizer,
+    a full-text table narrows each search down to the files that can contain the search text.
+    The cell values are stored as JSON, see encode_row(). The database is kept in user_data_dir() by default.
+    """
+    CELL_SEPARATOR = '\x1f'
+    SCHEMA_VERSION = 4  # An index written with another layout is dropped and rebuilt on open
+    VALUE_TYPES = {'datetime': datetime.datetime, 'date': datetime.date, 'time': datetime.time}
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(user_data_dir(), 'excel_search_index.db')
+        self._lock = threading.Lock()
+        self._candidates = (None, 0, set())  # (needles, last row id searched, file ids) of the last full-text query
+        self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS rows;
+                DROP TABLE IF EXISTS rows_fts;
+            """)
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                active_sheet TEXT
+            );
+            CREATE TABLE IF NOT EXISTS rows (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Never reused, so rows added after a full-text query have higher ids
+                file_id INTEGER NOT NULL,
+                row_idx INTEGER NOT NULL,
+                sheet TEXT,
+                text TEXT NOT NULL,
+                vals TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS rows_file_id ON rows (file_id, row_idx);
+        """)
+        try:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS rows_fts USING fts5(text, tokenize='trigram')")
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+        self.conn.commit()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def row_text(cls, row):
+        """Return the lowercased, searchable text of a row. Empty cells are left out, like in the row scan."""
+        return cls.CELL_SEPARATOR.join(str(value).lower() for value in row if value)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def encode_row(cls, row):
+        """
+        Return the cell values of a row as JSON. Dates and times, which JSON lacks, are written as {"type": name,
+        "value": ISO format} objects, durations as seconds and any other value that isn't a JSON type as text.
+        """
+        def tagged(value):
+            for name, value_type in cls.VALUE_TYPES.items():
+                if isinstance(value, value_type):
+                    return {'type': name, 'value': value.isoformat()}
+            if isinstance(value, datetime.timedelta):
+                return value.total_seconds()
+            return str(value)
+
+        return json.dumps(row, default=tagged, ensure_ascii=False)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def decode_row(cls, vals):
+        """Return the cell values written by encode_row()."""
+        def untagged(value):
+            return cls.VALUE_TYPES[value['type']].fromisoformat(value['value'])
+
+        return json.loads(vals, object_hook=untagged)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _file_entry(self, file_path):
+        with self._lock:
+            return self.conn.execute("SELECT id, size, mtime_ns, active_sheet FROM files WHERE path = ?", (file_path,)).fetchone()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def is_fresh(self, file_path, stat=None):
+        """Return True if the file is indexed and has not changed since."""
+        entry = self._file_entry(file_path)
+        if entry is None:
+            return False
+        stat = stat or os.stat(file_path)
+        return entry[1] == stat.st_size and entry[2] == stat.st_mtime_ns
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def lookup(self, file_path, query):
+        """
+        Answers a search from the index.
+
+        Args:
+            file_path (str): The file to look up.
+            query (SearchQuery): The prepared search.
+
+        Returns:
+            list: The matching SearchMatch records, or None if the file is not indexed or has changed since it was indexed.
+        """
+        entry = self._file_entry(file_path)
+        if entry is None:
+            return None
+        stat = os.stat(file_path)
+        if entry[1] != stat.st_size or entry[2] != stat.st_mtime_ns:
+            return None
+
+        file_id, active_sheet = entry[0], entry[3]
+        needles = query.literal_needles()
+        candidates = self._candidate_files(needles)
+        if candidates is not None and file_id not in candidates:
+            return []
+
+        sql = "SELECT sheet, row_idx, vals FROM rows WHERE file_id = ?"
+        params = [file_id]
+        if not query.all_sheets:
+            sql += " AND sheet IS ?"
+            params.append(active_sheet)
+        if needles:
+            # Narrow the rows down in SQLite, the query decides about case and whole cells below
+            sql += " AND (" + " OR ".join("instr(text, ?) > 0" for _ in needles) + ")"
+            params += needles
+        sql += " ORDER BY rowid"
+
+        found = []
+        with self._lock:
+            for sheet, row_number, vals in self.conn.execute(sql, params):
+                row = self.decode_row(vals)
+                if query.row_matches(row):
+                    found.append(SearchMatch(file_path, sheet, row_number, row))
+                    if not query.all_rows:
+                        break
+        return found
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _candidate_files(self, needles):
+        """
+        Return the ids of the files whose text may contain one of the needles, or None if the full-text table can't answer.
+        The trigram tokenizer needs at least three characters, and only ASCII is folded the same way as str.lower().
+
+        The ids are kept for the needles of the last query. Rows written since, by this or another connection such as
+        a worker process, are searched on their own and their files added, so an index being built or refreshed doesn't
+        make every query search the whole table again. Ids of files removed since may be left in, which only costs
+        their lookup a query of their rows.
+        """
+        if not self.has_fts or not needles:
+            return None
+        for needle in needles:
+            if len(needle) < 3 or not needle.isascii() or self.CELL_SEPARATOR in needle:
+                return None
+        with self._lock:
+            last_row = self.conn.execute("SELECT MAX(rowid) FROM rows").fetchone()[0] or 0
+            cached_needles, searched_row, ids = self._candidates
+            if cached_needles != tuple(needles):
+                searched_row, ids = 0, set()
+            if last_row > searched_row:
+                phrases = ' OR '.join('"' + needle.replace('"', '""') + '"' for needle in needles)
+                ids |= {file_id for file_id, in self.conn.execute(
+                    "SELECT DISTINCT rows.file_id FROM rows_fts JOIN rows ON rows.rowid = rows_fts.rowid"
+                    " WHERE rows_fts MATCH ? AND rows_fts.rowid > ?", (phrases, searched_row))}
+                searched_row = last_row
+            self._candidates = (tuple(needles), searched_row, ids)
+            return ids
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def store(self, file_path, rows, stat=None, active_sheet=None):
+        """
+        Replace the indexed content of a file with the given (sheet, row_number, row) records, in file order.
+        active_sheet is the sheet searched when a query doesn't ask for all sheets, None for CSV files.
+        """
+        stat = stat or os.stat(file_path)
+        file_id = self.begin(file_path)
+        batch = []
+        for record in rows:
+            batch.append(record)
+            if len(batch) >= INDEX_BATCH_ROWS:
+                self.add_rows(file_id, batch)
+                batch = []
+        self.add_rows(file_id, batch)
+        self.complete(file_id, stat, active_sheet)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def begin(self, file_path):
+        """
+        Start replacing the indexed content of a file, to be added with add_rows() while the file is read.
+        The file is not answered from the index until complete() is called. Returns the id to pass to both.
+        """
+        with self._lock:
+            with self.conn:
+                self._delete(file_path)
+                # A size of -1 never matches the file, so an entry left incomplete by a stop or a crash is replaced
+                file_id = self.conn.execute("INSERT INTO files (path, size, mtime_ns) VALUES (?, -1, 0)", (file_path,)).lastrowid
+        return file_id
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def add_rows(self, file_id, rows):
+        """Add a batch of (sheet, row_number, row) records to a file started with begin(), in one transaction."""
+        if not rows:
+            return
+        with self._lock:
+            with self.conn:
+                for sheet, row_number, row in rows:
+                    text = self.row_text(row)
+                    rowid = self.conn.execute("INSERT INTO rows (file_id, row_idx, sheet, text, vals) VALUES (?, ?, ?, ?, ?)",
+                                              (file_id, row_number, sheet, text, self.encode_row(row))).lastrowid
+                    if self.has_fts:
+                        self.conn.execute("INSERT INTO rows_fts (rowid, text) VALUES (?, ?)", (rowid, text))
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def complete(self, file_id, stat, active_sheet=None):
+        """Mark a file started with begin() as indexed, with the os.stat result taken before it was read."""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("UPDATE files SET size = ?, mtime_ns = ?, active_sheet = ? WHERE id = ?",
+                                  (stat.st_size, stat.st_mtime_ns, active_sheet, file_id))
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _delete(self, file_path):
+        row = self.conn.execute("SELECT id FROM files WHERE path = ?", (file_path,)).fetchone()
+        if row is None:
+            return
+        if self.has_fts:
+            self.conn.execute("DELETE FROM rows_fts WHERE rowid IN (SELECT rowid FROM rows WHERE file_id = ?)", row)
+        self.conn.execute("DELETE FROM rows WHERE file_id = ?", row)
+        self.conn.execute("DELETE FROM files WHERE id = ?", row)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def prune_missing(self):
+        """Remove files that no longer exist from the index. Returns the number of removed files."""
+        with self._lock:
+            paths = [path for path, in self.conn.execute("SELECT path FROM files")]
+            missing = [path for path in paths if not os.path.exists(path)]
+            with self.conn:
+                for path in missing:
+                    self._delete(path)
+        return len(missing)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def clear(self):
+        """Remove everything from the index."""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM rows")
+                self.conn.execute("DELETE FROM files")
+                if self.has_fts:
+                    self.conn.execute("DELETE FROM rows_fts")
+            self._candidates = (None, 0, set())
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+class ListingCache:
+    """
+    Persistent cache of directory listings, keyed by directory path and modification time.
+
+    Adding, removing or renaming an entry changes the modification time of its directory, so a directory whose mtime
+    is unchanged is answered from the cache with a single stat call instead of being listed again. Only the names of
+    the entries are kept: file sizes and mtimes are always read from the file system.
+    The listings are loaded on first use and changes are written back by save().
+    """
+    NAME_SEPARATOR = '\x00'  # Can't appear in a file name
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(user_data_dir(), 'excel_search_listings.db')
+        self._lock = threading.Lock()
+        self._listings = None  # {directory: (mtime_ns, subdirectory names, file names)}, loaded on first use
+        self._changed = {}  # {directory: listing or None if removed} not saved yet
+        self.hits = 0  # Directories answered from the cache
+        self.misses = 0  # Directories listed again
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS listings (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, subdirs TEXT NOT NULL, files TEXT NOT NULL)")
+        return conn
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _load(self):
+        """Read the saved listings. Must be called with the lock held."""
+        if self._listings is None:
+            self._listings = {}
+            try:
+                conn = self._connect()
+                try:
+                    for path, mtime_ns, subdirs, files in conn.execute("SELECT path, mtime_ns, subdirs, files FROM listings"):
+                        self._listings[path] = (mtime_ns, self._split(subdirs), self._split(files))
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass  # An unreadable cache only costs a full listing
+        return self._listings
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def _split(cls, names):
+        return names.split(cls.NAME_SEPARATOR) if names else []
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def get(self, path, mtime_ns):
+        """Return the cached (subdirectory names, file names) of a directory, or None if it changed or is not cached."""
+        with self._lock:
+            listing = self._load().get(path)
+            if listing is None or listing[0] != mtime_ns:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return listing[1], listing[2]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def put(self, path, mtime_ns, subdirs, files):
+        """
+        Store the listing of a directory, read after its mtime_ns was taken. The cached listings of subdirectories
+        that are gone are dropped with it.
+        """
+        with self._lock:
+            listings = self._load()
+            previous = listings.get(path)
+            if previous is not None:
+                removed = set(previous[1]).difference(subdirs)
+                if removed:
+                    prefixes = tuple(os.path.join(path, name) for name in removed)
+                    below = tuple(prefix + os.sep for prefix in prefixes)
+                    for cached in [cached for cached in listings if cached in prefixes or cached.startswith(below)]:
+                        del listings[cached]
+                        self._changed[cached] = None
+            listing = (mtime_ns, list(subdirs), list(files))
+            listings[path] = listing
+            self._changed[path] = listing
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def save(self):
+        """Write the listings changed since the last save to the database."""
+        with self._lock:
+            changed, self._changed = self._changed, {}
+        if not changed:
+            return
+        separator = self.NAME_SEPARATOR
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany("DELETE FROM listings WHERE path = ?",
+                                     [(path,) for path, listing in changed.items() if listing is None])
+                    conn.executemany("INSERT OR REPLACE INTO listings (path, mtime_ns, subdirs, files) VALUES (?, ?, ?, ?)",
+                                     [(path, listing[0], separator.join(listing[1]), separator.join(listing[2]))
+                                      for path, listing in changed.items() if listing is not None])
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            with self._lock:  # Keep the changes for the next save
+                self._changed = {**changed, **self._changed}
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def clear(self):
+        """Remove all cached listings."""
+        with self._lock:
+            self._listings = {}
+            self._changed = {}
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM listings")
+            finally:
+                conn.close()
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def _process_context():
+    """
+    Return the multiprocessing context for the worker pool. Forking while the directory walker threads are running
+    can deadlock the child, so a fork server is used where available, and spawn elsewhere.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+_worker_indexes = {}  # ContentIndex per database path, reused by the tasks running in a worker process
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def _run_file_task(method_name, file_path, args, index_path=None, options=None, hash_content=False):
+    """
+    Runs an ExcelSearcher method on a single file in a worker process.
+
+    Args:
+        method_name (str): The ExcelSearcher method to call with the file path, e.g. 'search_excel'.
+        file_path (str): The file to process.
+        args (tuple): Additional arguments for the method.
+        index_path (str): Path of the content index database, or None to search without an index.
+        options (dict): Keyword arguments for the ExcelSearcher, as returned by ExcelSearcher.worker_options().
+        hash_content (bool): Also hash the file content, see ExcelSearcher.run_timed.
+
+    Returns:
+        tuple: (result, error, file_stats) as returned by ExcelSearcher.run_timed.
+    """
+    index = None
+    if index_path:
+        index = _worker_indexes.get(index_path)
+        if index is None:
+            index = _worker_indexes[index_path] = ContentIndex(index_path)
+    searcher = ExcelSearcher(os.path.dirname(file_path), index=index, **(options or {}))
+    searcher.searching = True
+    return searcher.run_timed(method_name, file_path, args, hash_content)
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def _worker_main(connection):
+    """Runs the _run_file_task arguments received from a WorkerPool one at a time, until the pool closes the connection."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the parent, which terminates the workers
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        result = _run_file_task(*task)
+        try:
+            connection.send(result)
+        except Exception as e:  # The result can't be pickled
+            file_stats = result[2]
+            file_stats.update(status='error', error=f"{type(e).__name__}: {e}")
+            connection.send((None, file_stats['error'], file_stats))
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class WorkerPool:
+    """
+    Worker processes that each run one file task at a time, so it is known which file every worker is busy with and
+    for how long. A worker stuck in a parse can be terminated, for a time limit or when the search is stopped, without
+    waiting for it and without affecting the other workers. Workers are started as they are needed.
+
+    Args:
+        size (int): The maximum number of worker processes.
+    """
+    def __init__(self, size):
+        self.size = max(1, size)
+        self.context = _process_context()
+        self.idle = []  # (process, connection) of the workers waiting for a task
+        self.busy = {}  # connection -> (process, key, started) of the workers running a task
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def has_capacity(self):
+        return len(self.busy) < self.size
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def submit(self, key, task):
+        """Send the _run_file_task arguments to an idle worker, starting one if needed. key identifies the task."""
+        if self.idle:
+            process, connection = self.idle.pop()
+        else:
+            connection, child_connection = self.context.Pipe()
+            process = self.context.Process(target=_worker_main, args=(child_connection,), daemon=True)
+            process.start()
+            child_connection.close()
+        connection.send(task)
+        self.busy[connection] = (process, key, time.monotonic())
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def wait(self, timeout):
+        """Wait up to timeout seconds for tasks to finish, and return their (key, (result, error, file_stats))."""
+        finished = []
+        for connection in multiprocessing.connection.wait(list(self.busy), timeout):
+            process, key, _ = self.busy.pop(connection)
+            try:
+                outcome = connection.recv()
+            except (EOFError, OSError):
+                # The worker died, e.g. it ran out of memory on a huge file
+                self._stop(process, connection)
+                outcome = (None, f"Worker process exited with code {process.exitcode}", None)
+            else:
+                self.idle.append((process, connection))
+            finished.append((key, outcome))
+        return finished
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def running(self):
+        """Return (key, seconds) for each task that is running."""
+        now = time.monotonic()
+        return [(key, now - started) for _, key, started in self.busy.values()]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def cancel(self, key):
+        """Terminate the worker running the task with this key."""
+        for connection, (process, task_key, _) in list(self.busy.items()):
+            if task_key == key:
+                del self.busy[connection]
+                self._stop(process, connection)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _stop(process, connection):
+        connection.close()
+        if process.is_alive():
+            process.terminate()
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+                process.join(1)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """Stop all workers. Tasks still running are interrupted, nobody is waiting for their results anymore."""
+        for connection, (process, _, _) in self.busy.items():
+            self._stop(process, connection)
+        self.busy.clear()
+        for process, connection in self.idle:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process, connection in self.idle:
+            process.join(5)
+            self._stop(process, connection)
+        self.idle.clear()
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class SharedWorkerPool:
+    """
+    A WorkerPool shared by the searches running concurrently in one process, e.g. in the search server, so they
+    don't each start their own workers. Each search takes a lease(), which has the WorkerPool interface but only
+    sees its own tasks. The workers are divided evenly over the leases and keep running between searches.
+
+    Args:
+        size (int): The maximum number of worker processes.
+    """
+    def __init__(self, size):
+        self.pool = WorkerPool(size)
+        self.lock = threading.Lock()
+        self.leases = []
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def lease(self):
+        lease = _PoolLease(self)
+        with self.lock:
+            self.leases.append(lease)
+        return lease
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def busy_workers(self):
+        """Return the number of workers running a task."""
+        with self.lock:
+            return len(self.pool.busy)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        with self.lock:
+            self.pool.close()
+            self.leases.clear()
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+class _PoolLease:
+    """One search's share of a SharedWorkerPool, with the WorkerPool interface. Closing it interrupts only its own tasks."""
+    def __init__(self, shared):
+        self.shared = shared
+        self.keys = set()  # Keys of the tasks submitted and not returned by wait() yet
+        self.finished = []  # (key, outcome) received for this lease by any lease's wait()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    @property
+    def busy(self):
+        """The keys of the tasks not returned by wait() yet, empty when the lease has nothing running."""
+        return self.keys
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def has_capacity(self):
+        shared = self.shared
+        with shared.lock:
+            fair_share = max(1, shared.pool.size // max(1, len(shared.leases)))
+            return shared.pool.has_capacity() and len(self.keys) < fair_share
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def submit(self, key, task):
+        with self.shared.lock:
+            self.shared.pool.submit((self, key), task)
+            self.keys.add(key)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def wait(self, timeout):
+        """Wait up to timeout seconds for tasks of this lease to finish, handing the other finished tasks to their leases."""
+        shared = self.shared
+        deadline = time.monotonic() + timeout
+        while True:
+            with shared.lock:
+                if not self.finished and self.keys:
+                    # Short waits, so the other leases get the lock to submit and collect in between
+                    for (lease, key), outcome in shared.pool.wait(max(0, min(0.02, deadline - time.monotonic()))):
+                        lease.finished.append((key, outcome))
+                if self.finished or not self.keys or time.monotonic() >= deadline:
+                    finished, self.finished = self.finished, []
+                    self.keys.difference_update(key for key, _ in finished)
+                    return finished
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def running(self):
+        with self.shared.lock:
+            return [(key, seconds) for (lease, key), seconds in self.shared.pool.running() if lease is self]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def cancel(self, key):
+        with self.shared.lock:
+            self.shared.pool.cancel((self, key))
+            self.keys.discard(key)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def close(self):
+        """Give the lease back, interrupting its tasks still running. The workers stay with the shared pool."""
+        shared = self.shared
+        with shared.lock:
+            for key in self.keys:
+                shared.pool.cancel((self, key))
+            self.keys.clear()
+            self.finished = []
+            if self in shared.leases:
+                shared.leases.remove(self)
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------------------
+class ExcelSearcher:
+    def __init__(self, base_folder, recursive=False, workers=1, index=None, prefilter=True, csv_encoding=None, csv_delimiter=';',
+                 include_dirs=None, exclude_dirs=None, max_depth=None, walk_threads=8, profile_callback=None, dedupe=True,
+                 result_cache=None, order=None, order_window=1000, max_file_size=None, file_timeout=None, over_budget='defer',
+                 isolate=False, listing_cache=None, worker_pool=None):
+        self.base_folder = base_folder
+        self.recursive = recursive
+        self.include_dirs = include_dirs or []  # Globs for the direct subfolders of base_folder to search, empty for all
+        self.exclude_dirs = exclude_dirs or []  # Globs for directory names or relative paths to prune
+        self.max_depth = max_depth  # Deepest folder level searched when recursive, None for no limit
+        self.walk_threads = max(1, walk_threads)  # Threads listing directories concurrently
+        self.listing_cache = listing_cache  # Optional ListingCache so only changed directories are listed again
+        self.workers = max(1, workers or 1)  # Number of worker processes used for content scanning, 1 = sequential
+        self.index = index  # Optional ContentIndex answering searches for unchanged files
+        self.prefilter = prefilter  # Reject .xlsx/.csv files from their raw content before parsing them
+        self.csv_encoding = csv_encoding  # Encoding of CSV files, None to detect it per file
+        self.csv_delimiter = csv_delimiter  # Delimiter of CSV files, None to sniff it per file
+        self.searching = False
+        self.skipped_files = []  # (file, reason) for files that could not be searched in the last run
+        self.profile_callback = profile_callback  # Called with the timing record of each file as it finishes
+        self.dedupe = dedupe  # Search identical copies of a file once per search, without a content index
+        self.result_cache = result_cache  # Optional ResultCache keeping the results per file content across searches
+        self.order = order  # Order files are searched in: None (as found), 'size' (smallest first), 'mtime' (newest first) or 'path'
+        self.order_window = order_window  # Number of found files the order is applied within, None to sort them all
+        self.max_file_size = max_file_size  # Files larger than this many bytes are over budget, None for no limit
+        self.file_timeout = file_timeout  # Seconds a file may take before it is over budget, None for no limit
+        self.over_budget = over_budget  # 'defer' to search over budget files last (without a time limit) or 'skip' them
+        # Search in worker processes even with a single worker, so a stop interrupts a parse instead of waiting for it
+        self.isolate = isolate
+        self.worker_pool = worker_pool  # Optional SharedWorkerPool to search in, instead of starting workers for this search
+        self.stats = SearchStats()  # Timings of the last run
+        self.file_stats = new_file_stats(None)  # Timing record of the file currently being processed
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def search_excel_files(self, fname_match, progress_callback=None, include_csv=False):
+        return list(self.iter_excel_files(fname_match, progress_callback, include_csv))
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def iter_excel_files(self, fname_match, progress_callback=None, include_csv=False, file_info=None):
+        """
+        Lazily yields the files below the base folder whose name matches, while the directories are still being listed.
+
+        Sibling directories are listed concurrently by a pool of walk_threads threads with os.scandir, so the latency
+        of network shares overlaps and the entry types come from the directory listing instead of extra stat calls.
+        Without recursive, only the files in the direct subfolders of the base folder are returned.
+        Directories whose name or relative path matches one of exclude_dirs are skipped at any level. When include_dirs
+        is set, only the direct subfolders of the base folder matching one of its globs are searched.
+        Directories that can't be listed are added to skipped_files.
+        With a listing_cache, directories whose mtime is unchanged since they were cached are not listed again.
+        If a file_info dict is given, the os.stat results the listing brings along are stored in it by the listing
+        threads. Files of directories answered from the listing cache get no entry, their users stat them if needed.
+        """
+        file_matches = compile_fname_matcher(fname_match, include_csv)
+        include_dirs = compile_globs(self.include_dirs)
+        exclude_dirs = compile_globs(self.exclude_dirs)
+        file_depth = 0 if self.recursive else 1  # Shallowest level whose files are returned
+        max_depth = self.max_depth if self.recursive else 1
+        base_folder = self.base_folder
+
+        listings = queue.Queue()  # (directory, matching files, error) per listed directory, None once all are done
+        stopped = threading.Event()
+        outstanding = [1]  # Directories submitted but not listed yet
+        lock = threading.Lock()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.walk_threads)
+        stats = self.stats
+        listing_cache = self.listing_cache
+        walk_started = time.perf_counter()
+
+        def wanted_dir(path, name, depth):
+            relative = os.path.relpath(path, base_folder).replace(os.sep, '/')
+            if exclude_dirs and (exclude_dirs(name) or exclude_dirs(relative)):
+                return False
+            if include_dirs and depth == 1 and not (include_dirs(name) or include_dirs(relative)):
+                return False
+            return max_depth is None or depth <= max_depth
+
+        def read_dir(path):
+            """
+            Return the subdirectory names, the file names and a DirEntry per file name (None when answered from the
+            listing cache) of a directory. Symbolic links to directories are left out, like os.walk doesn't follow them.
+            """
+            mtime_ns = None
+            if listing_cache is not None:
+                mtime_ns = os.stat(path).st_mtime_ns
+                cached = listing_cache.get(path, mtime_ns)
+                if cached is not None:
+                    return cached[0], cached[1], None
+            subdir_names, file_names, file_entries = [], [], {}
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if stopped.is_set():
+                        return subdir_names, file_names, file_entries  # Incomplete, so not cached
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if not entry.is_symlink():
+                            subdir_names.append(entry.name)
+                    else:
+                        file_names.append(entry.name)
+                        file_entries[entry.name] = entry
+            if listing_cache is not None:
+                listing_cache.put(path, mtime_ns, subdir_names, file_names)
+            return subdir_names, file_names, file_entries
+
+        def list_dir(path, depth):
+            files, error = [], None
+            try:
+                subdir_names, file_names, file_entries = read_dir(path)
+                subdirs = []
+                for name in subdir_names:
+                    subdir = os.path.join(path, name)
+                    if wanted_dir(subdir, name, depth + 1):
+                        subdirs.append(subdir)
+                if depth >= file_depth:
+                    for name in file_names:
+                        if not file_matches(name):
+                            continue
+                        file_path = os.path.join(path, name)
+                        files.append(file_path)
+                        if file_info is not None and file_entries is not None:
+                            try:
+                                file_info[file_path] = file_entries[name].stat()  # Free on Windows, one call elsewhere
+                            except OSError:
+                                pass
+                for subdir in subdirs:
+                    if stopped.is_set():
+                        break
+                    with lock:
+                        outstanding[0] += 1
+                    try:
+                        executor.submit(list_dir, subdir, depth + 1)
+                    except RuntimeError:  # The pool was shut down because the caller stopped
+                        with lock:
+                            outstanding[0] -= 1
+            except OSError as e:
+                error = f"{type(e).__name__}: {e}"
+            listings.put((path, files, error))
+            with lock:
+                outstanding[0] -= 1
+                if outstanding[0] == 0:
+                    if not stopped.is_set():
+                        stats.walk_seconds = time.perf_counter() - walk_started
+                    listings.put(None)
+
+        executor.submit(list_dir, base_folder, 0)
+        try:
+            while self.searching:
+                try:
+                    listing = listings.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if listing is None:
+                    break
+                path, files, error = listing
+                stats.directories += 1
+                if error:
+                    stats.skipped_directories += 1
+                    self.skipped_files.append((path, error))
+                if progress_callback:
+                    progress_callback(path)
+                yield from files
+        finally:
+            stopped.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            if listing_cache is not None:
+                listing_cache.save()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def worker_options(self):
+        """Return the keyword arguments that recreate this searcher's file handling in a worker process."""
+        return {'prefilter': self.prefilter, 'csv_encoding': self.csv_encoding, 'csv_delimiter': self.csv_delimiter}
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def csv_dialect(self, file_path):
+        """Return the (encoding, delimiter) of a CSV file, detecting whichever is not configured from a bounded sample."""
+        started = time.perf_counter()
+        encoding = self.csv_encoding or detect_encoding(file_path)
+        delimiter = self.csv_delimiter
+        if not delimiter:
+            with open(file_path, 'r', newline='', encoding=encoding, errors='replace') as csvfile:
+                sample = csvfile.read(CSV_SAMPLE_SIZE)
+            try:
+                delimiter = csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS).delimiter
+            except csv.Error:
+                delimiter = ';'
+        self.file_stats['detect'] += time.perf_counter() - started
+        return encoding, delimiter
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def iter_rows(self, file_path, all_sheets=False, sheet_info=None, dialect=None):
+        """
+        Yield (sheet, row_number, row) for each row of the searched sheet of a file, streaming where the format allows it.
+        The sheet is None for CSV files and row numbers start at 1. dialect is the (encoding, delimiter) of a CSV
+        file if csv_dialect() was already called for it.
+
+        With all_sheets, every sheet of a workbook is read, the active/first one first. If a sheet_info dict is given,
+        the name of the active sheet is stored in it under 'active'. The parser and the time spent opening the file
+        are added to file_stats.
+        """
+        if sheet_info is None:
+            sheet_info = {}
+        file_stats = self.file_stats
+        started = time.perf_counter()
+        if file_path.lower().endswith(('.xlsx', '.xltx', '.xlsm')):
+            import openpyxl
+
+            file_stats['parser'] = 'openpyxl'
+            # Read-only mode streams the sheet XML row by row instead of building the whole workbook in memory
+            workbook = openpyxl.load_workbook(file_path, read_only=True)
+            file_stats['open'] += time.perf_counter() - started
+            try:
+                active = workbook.active
+                sheet_info['active'] = active.title
+                sheets = [active] + [sheet for sheet in workbook.worksheets if sheet is not active] if all_sheets else [active]
+                for sheet in sheets:
+                    # Read-only sheets trust the stored <dimension>, which third-party exporters often leave stale.
+                    # Without it, rows and columns are read as far as the sheet data actually goes.
+                    sheet.reset_dimensions()
+                    for row_number, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+                        yield sheet.title, row_number, list(row)
+            finally:
+                workbook.close()
+        elif file_path.lower().endswith('.xls'):
+            import xlrd
+
+            file_stats['parser'] = 'xlrd'
+            # On demand, only the workbook globals are decoded here and each sheet when it is first asked for
+            workbook = xlrd.open_workbook(file_path, on_demand=True)
+            file_stats['open'] += time.perf_counter() - started
+            try:
+                sheet_names = workbook.sheet_names()
+                sheet_info['active'] = sheet_names[0] if sheet_names else None
+                for sheet_idx in range(len(sheet_names) if all_sheets else min(1, len(sheet_names))):
+                    sheet = workbook.sheet_by_index(sheet_idx)
+                    try:
+                        # row_values slices the sheet's value array, without creating a Cell object per cell
+                        for row_idx in range(sheet.nrows):
+                            yield sheet.name, row_idx + 1, sheet.row_values(row_idx)
+                    finally:
+                        # Drop the decoded sheet before the next one is loaded
+                        del sheet
+                        workbook.unload_sheet(sheet_idx)
+            finally:
+                workbook.release_resources()
+        elif file_path.lower().endswith('.csv'):
+            sheet_info['active'] = None
+            file_stats['parser'] = 'csv'
+            encoding, delimiter = dialect or self.csv_dialect(file_path)
+            started = time.perf_counter()  # The detection is timed separately
+            with open(file_path, 'r', newline='', encoding=encoding, errors='replace') as csvfile:
+                file_stats['open'] += time.perf_counter() - started
+                for row_number, row in enumerate(csv.reader(csvfile, delimiter=delimiter), start=1):
+                    yield None, row_number, row
+        else:
+            raise ValueError("Unsupported file format")
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def search_excel(self, file_path, search_text):
+        return [match.row for match in self.find_matches(file_path, search_text)]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def find_matches(self, file_path, search_text):
+        """
+        Search a single file and return the matching rows as a list of SearchMatch records, empty if there are none.
+
+        search_text is a SearchQuery, or the text(s) for a default query. Only the first matching row is returned
+        unless the query asks for all rows.
+        """
+        query = SearchQuery.of(search_text)
+        file_stats = self.file_stats
+        clock = time.perf_counter
+        if self.index is not None:
+            started = clock()
+            found = self.index.lookup(file_path, query)
+            if found is not None:
+                file_stats.update(parser='index', status='indexed', matches=len(found))
+                file_stats['scan'] += clock() - started
+                return found
+            # Not indexed yet or changed since, parse the whole file so it can be answered from the index next time
+            found = self.index_file(file_path, query)
+            if found is None:
+                file_stats['status'] = 'stopped'
+                return []
+            file_stats['matches'] = len(found)
+            return found
+
+        needles = query.literal_needles()
+        if self.prefilter and needles and file_path.lower().endswith(('.xlsx', '.xltx', '.xlsm')):
+            started = clock()
+            may_contain = xlsx_may_contain(file_path, needles)
+            file_stats['prefilter'] += clock() - started
+            if not may_contain:
+                file_stats.update(parser='prefilter', status='prefiltered')
+                return []
+        dialect = None
+        if self.prefilter and needles and file_path.lower().endswith('.csv') and csv_byte_searchable(needles):
+            dialect = self.csv_dialect(file_path)
+            found = self._search_csv(file_path, query, needles, dialect)
+            if found is not None:
+                file_stats['matches'] = len(found)
+                return found
+        found = []
+        opened = file_stats['open']
+        rows = self.iter_rows(file_path, all_sheets=query.all_sheets, dialect=dialect)
+        reading = scanning = 0.0
+        count = 0
+        try:
+            # Rows are parsed lazily, so the time until each row arrives is parse time (opening included, taken off below)
+            started = clock()
+            for sheet, row_number, row in rows:
+                fetched = clock()
+                reading += fetched - started
+                count += 1
+                if not self.searching:
+                    file_stats['status'] = 'stopped'
+                    break
+                matched = query.row_matches(row)
+                started = clock()
+                scanning += started - fetched
+                if matched:
+                    found.append(SearchMatch(file_path, sheet, row_number, row))
+                    if not query.all_rows:
+                        break
+        finally:
+            rows.close()  # Release the file as soon as the first match is found
+            file_stats['parse'] += max(0.0, reading - (file_stats['open'] - opened))
+            file_stats['scan'] += scanning
+            file_stats['rows'] += count
+            file_stats['matches'] = len(found)
+
+        return found
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _search_csv(self, file_path, query, needles, dialect):
+        """
+        Searches a CSV file at byte level for the lowercased needles, which csv_byte_searchable() accepted, and only
+        parses the rows around a match. dialect is the (encoding, delimiter) of the file.
+
+        Returns the found SearchMatch records, or None if the byte-level search can't be used for this file and
+        the file has to be parsed row by row instead.
+        """
+        encoding, delimiter = dialect
+        # Only encodings that store ASCII as single bytes can be searched for the ASCII needles
+        try:
+            codec = codecs.lookup(encoding).name
+        except LookupError:
+            return None
+        if codec == 'utf-8-sig':
+            codec = 'utf-8'  # Only a BOM in front of UTF-8, the first line is decoded without it below
+        if codec.startswith(('utf-16', 'utf-32')) or 'a'.encode(codec) != b'a':
+            return None
+        needles_bytes = [needle.encode('ascii') for needle in needles]
+
+        if os.path.getsize(file_path) == 0:
+            return []
+        file_stats = self.file_stats
+        file_stats['parser'] = 'csv-bytes'
+        started = time.perf_counter()
+        found = []
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                offset = find_in_bytes(data, needles_bytes)
+                checked = 0  # Offset up to which the file was checked for quotes and lone carriage returns
+                lines_counted, line_number = 0, 1  # Without quoted fields every line is one row
+                while offset != -1:
+                    if not self.searching:
+                        file_stats['status'] = 'stopped'
+                        break
+                    line_start = data.rfind(b'\n', 0, offset) + 1
+                    line_end = data.find(b'\n', offset)
+                    if line_end == -1:
+                        line_end = len(data)
+                    # Quoted fields can span lines and a lone \r ends a row for the CSV parser, so with either of
+                    # them in the file so far, \n doesn't give the rows and their numbers
+                    if data.find(b'"', checked, line_end) != -1 or CSV_BARE_CR.search(data, checked, line_end + 1):
+                        return None
+                    checked = line_end
+                    line_number += count_lines(data, lines_counted, line_start)
+                    lines_counted = line_start
+                    text = data[line_start:line_end].decode(encoding, errors='replace')
+                    for row in csv.reader([text], delimiter=delimiter):
+                        file_stats['rows'] += 1
+                        if query.row_matches(row):
+                            found.append(SearchMatch(file_path, None, line_number, row))
+                    if found and not query.all_rows:
+                        break
+                    # Look for the next matching line, also when the byte match spanned several cells
+                    offset = find_in_bytes(data, needles_bytes, start=line_end)
+            finally:
+                file_stats['scan'] += time.perf_counter() - started
+        return found
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def index_file(self, file_path, query=None):
+        """
+        Parse every sheet of a file and store its rows in the content index, INDEX_BATCH_ROWS at a time while the
+        file is read, so memory use doesn't grow with the file. With a query, the rows are matched on the way.
+
+        Returns:
+            list: The SearchMatch records found for the query, empty without one, or None if the search was stopped.
+        """
+        stat = os.stat(file_path)
+        sheet_info = {}
+        found = []
+        batch = []
+        file_stats = self.file_stats
+        clock = time.perf_counter
+        opened = file_stats['open']
+        storing = scanning = 0.0
+        count = 0
+        file_id = self.index.begin(file_path)
+        rows = self.iter_rows(file_path, all_sheets=True, sheet_info=sheet_info)
+        started = clock()
+        try:
+            for record in rows:
+                if not self.searching:
+                    return None
+                count += 1
+                batch.append(record)
+                if query is not None and (query.all_rows or not found):
+                    matching = clock()
+                    sheet, row_number, row = record
+                    if (query.all_sheets or sheet == sheet_info['active']) and query.row_matches(row):
+                        found.append(SearchMatch(file_path, sheet, row_number, row))
+                    scanning += clock() - matching
+                if len(batch) >= INDEX_BATCH_ROWS:
+                    writing = clock()
+                    self.index.add_rows(file_id, batch)
+                    batch = []
+                    storing += clock() - writing
+        finally:
+            rows.close()
+            file_stats['parse'] += max(0.0, clock() - started - scanning - storing - (file_stats['open'] - opened))
+            file_stats['scan'] += scanning
+            file_stats['rows'] += count
+        self.index.add_rows(file_id, batch)
+        self.index.complete(file_id, stat, sheet_info.get('active'))
+        return found
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _refresh_file(self, file_path):
+        """Index a file if it is new or has changed since it was indexed. Returns True if the file was parsed."""
+        if self.index.is_fresh(file_path):
+            self.file_stats.update(parser='index', status='indexed')
+            return False
+        if self.index_file(file_path) is None:
+            self.file_stats['status'] = 'stopped'
+            return False
+        return True
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def iter_matches(self, fname_match, search_text, progress_callback=None, include_csv=False):
+        """
+        Searches the matching files and yields a SearchMatch for every matching row as soon as its file is done.
+        search_text is a SearchQuery, or the text(s) for a default query.
+
+        With several workers the files finish, and are yielded, in completion order rather than enumeration order.
+        Closing the generator early stops the search.
+        """
+        self.searching = True
+        self.skipped_files = []
+        self.stats = SearchStats()
+        tasks = None
+        try:
+            file_info = self._file_info('find_matches')
+            excel_files = self.iter_excel_files(fname_match, progress_callback, include_csv, file_info)
+            tasks = self._map_files(excel_files, 'find_matches', (SearchQuery.of(search_text),), progress_callback, file_info)
+            for _, _, matches in tasks:
+                yield from matches
+        finally:
+            self.searching = False
+            if tasks is not None:
+                tasks.close()  # Shuts the worker pool down when the caller stopped early
+            self.stats.finish()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def search_excel_files_with_text(self, fname_match, search_text, progress_callback=None, search_results_callback=None, include_csv=False):
+        self.searching = True
+        self.skipped_files = []
+        self.stats = SearchStats()
+        file_info = self._file_info('find_matches')
+        excel_files = self.iter_excel_files(fname_match, progress_callback, include_csv, file_info)
+        results = {}
+
+        query = SearchQuery.of(search_text)  # Prepared once, not per file or cell
+
+        for position, file, matches in self._map_files(excel_files, 'find_matches', (query,), progress_callback, file_info):
+            if matches:
+                found_rows = [match.row for match in matches]
+                results[position] = (file, found_rows)
+                if search_results_callback:
+                    search_results_callback(file, os.path.basename(os.path.dirname(file)), os.path.basename(file), found_rows)
+
+        self.searching = False
+        self.stats.finish()
+        # Return the files in enumeration order, whether they were searched sequentially or in parallel
+        return [results[position] for position in sorted(results)]
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def refresh_index(self, fname_match, progress_callback=None, include_csv=False, rebuild=False):
+        """
+        Brings the content index up to date for the files matching the filename pattern.
+
+        Args:
+            fname_match (str): The filename pattern, as for search_excel_files.
+            progress_callback (callable): Called with the directory or file currently being processed.
+            include_csv (bool): Also index CSV files.
+            rebuild (bool): Drop the whole index first, so every file is parsed again.
+
+        Returns:
+            int: The number of files that were (re)parsed.
+        """
+        if self.index is None:
+            raise ValueError("No content index configured")
+        self.searching = True
+        self.skipped_files = []
+        self.stats = SearchStats()
+        if rebuild:
+            self.index.clear()
+        else:
+            self.index.prune_missing()
+        file_info = self._file_info('_refresh_file')
+        excel_files = self.iter_excel_files(fname_match, progress_callback, include_csv, file_info)
+        tasks = self._map_files(excel_files, '_refresh_file', (), progress_callback, file_info)
+        parsed = sum(1 for _, _, refreshed in tasks if refreshed)
+        self.searching = False
+        self.stats.finish()
+        return parsed
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def run_timed(self, method_name, file_path, args=(), hash_content=False):
+        """
+        Calls a searcher method on a single file, timing it in a fresh file_stats record.
+        With hash_content, the content hash of a successfully processed file is added to the record as 'digest'.
+
+        Returns:
+            tuple: (result, error, file_stats) where error is None on success, otherwise a description of the failure.
+        """
+        file_stats = self.file_stats = new_file_stats(file_path)
+        started = time.perf_counter()
+        try:
+            result, error = getattr(self, method_name)(file_path, *args), None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+            file_stats.update(status='error', error=error)
+        if hash_content and error is None and file_stats['status'] != 'stopped':
+            hashing = time.perf_counter()
+            try:
+                file_stats['digest'] = content_hash(file_path, running=lambda: self.searching)
+            except OSError:
+                pass
+            file_stats['hash'] += time.perf_counter() - hashing
+        file_stats['seconds'] = time.perf_counter() - started
+        file_stats.update(pid=os.getpid(), peak_rss=peak_rss_bytes())
+        try:
+            file_stats['bytes'] = os.path.getsize(file_path)
+        except OSError:
+            pass
+        return result, error, file_stats
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _record_file(self, file_stats):
+        self.stats.add_file(file_stats)
+        if self.profile_callback:
+            self.profile_callback(file_stats)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _skip_file(self, file, reason, status):
+        """Report a file that is not searched, in skipped_files and in stats."""
+        self.skipped_files.append((file, reason))
+        file_stats = new_file_stats(file)
+        file_stats.update(status=status, error=reason)
+        self._record_file(file_stats)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _schedule(self, excel_files, file_info):
+        """
+        Yields the files in the configured order and applies the size limit.
+
+        The order is applied within a window of order_window found files, so the first results don't wait for the
+        whole walk, or to all files after the walk if order_window is None. Files larger than max_file_size are
+        yielded after all others, or skipped with over_budget 'skip'. file_info has the os.stat results of the files.
+        """
+        def stat_of(file):
+            stat = file_info.get(file)
+            if stat is None:
+                try:
+                    stat = file_info[file] = os.stat(file)
+                except OSError:
+                    return None
+            return stat
+
+        sort_keys = {
+            'size': lambda file: stat_of(file).st_size if stat_of(file) else 0,
+            'mtime': lambda file: -stat_of(file).st_mtime if stat_of(file) else 0,
+            'path': lambda file: file,
+        }
+        if self.order is not None and self.order not in sort_keys:
+            raise ValueError(f"Unknown order: {self.order}")
+        sort_key = sort_keys.get(self.order)
+        heap = []
+        counter = itertools.count()  # Keeps files with equal keys in the order they were found
+        oversized = []
+        for file in excel_files:
+            if self.max_file_size is not None:
+                stat = stat_of(file)
+                if stat is not None and stat.st_size > self.max_file_size:
+                    if self.over_budget == 'skip':
+                        file_info.pop(file, None)
+                        self._skip_file(file, f"Larger than the size limit ({stat.st_size} bytes)", 'skipped')
+                    else:
+                        oversized.append(file)
+                    continue
+            if sort_key is None:
+                yield file
+                continue
+            heapq.heappush(heap, (sort_key(file), next(counter), file))
+            if self.order_window and len(heap) >= self.order_window:
+                yield heapq.heappop(heap)[2]
+        while heap:
+            yield heapq.heappop(heap)[2]
+        yield from sorted(oversized, key=sort_key) if sort_key else oversized
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _deduplicates(self, method_name):
+        """Return True if _map_files deduplicates the files it runs a method on, see _Deduplicator."""
+        return method_name == 'find_matches' and self.index is None and (self.dedupe or self.result_cache is not None)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _file_info(self, method_name):
+        """
+        Return a dict for iter_excel_files to collect the os.stat results of the files in, or None if running the method
+        on them doesn't need the stats, which are used to deduplicate, to order by size or mtime and for the size limit.
+        Files without an entry, e.g. from a cached listing, are stat'ed by _schedule and _Deduplicator when needed.
+        """
+        needed = self._deduplicates(method_name) or self.order in ('size', 'mtime') or self.max_file_size is not None
+        return {} if needed else None
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _map_files(self, excel_files, method_name, args, progress_callback=None, file_info=None):
+        """
+        Runs a searcher method on each file, in a pool of worker processes when more than one worker is configured,
+        a time limit is set, isolate is set or a shared worker_pool is given.
+
+        excel_files can be a lazy iterator, files are scheduled and handed to the workers while it is still producing
+        them. file_info can hold the os.stat results of the files, as collected by iter_excel_files.
+        Yields (position, file, result) as files finish, where position is the order the file was scheduled in.
+        Files that fail are added to skipped_files instead of aborting the run. The timing record of every file
+        is added to stats and passed to the profile_callback.
+
+        Searches without a content index are deduplicated: copies of a file with the same content are searched once,
+        and with a result_cache, contents searched the same way before aren't searched again.
+
+        In worker processes, a file running over file_timeout is interrupted, and searched again after all others
+        without a time limit if over_budget is 'defer'. Stopping the search interrupts the running files.
+        The files are then walked, ordered and hashed for deduplication in a scheduling thread, up to SCHEDULED_AHEAD
+        files ahead, so finished files are collected and time limits enforced while it waits for a slow directory.
+        """
+        file_info = file_info if file_info is not None else {}
+        dedup = None
+        if self._deduplicates(method_name):
+            dedup = _Deduplicator((SearchQuery.of(args[0]).key(), tuple(sorted(self.worker_options().items()))),
+                                  self.result_cache, running=lambda: self.searching)
+
+        def pending_files():
+            """
+            Yield (position, file, task) for each file, where task is whether the file has to be hashed after it is
+            searched, or (file_stats, result) if its result is known without searching it.
+            """
+            for position, file in enumerate(self._schedule(excel_files, file_info)):
+                stat = file_info.pop(file, None)
+                if dedup is None:
+                    yield position, file, False
+                    continue
+                action, file_stats = dedup.admit(position, file, stat)
+                if action == 'search':
+                    yield position, file, self.result_cache is not None and file_stats['digest'] is None
+                elif action == 'done':
+                    yield position, file, (file_stats, dedup.result(file))
+
+        def finish(position, file, result, error, file_stats):
+            """
+            Record a searched file, and return the (position, file, result) to yield for it and its waiting copies.
+            The matches of a file whose search was stopped midway are yielded, but not kept as the result of its content.
+            """
+            complete = error is None and file_stats['status'] != 'stopped'
+            copies = dedup.finished(file, result if complete else None, file_stats) if dedup is not None else []
+            self._record_file(file_stats)
+            if error:
+                self.skipped_files.append((file, error))
+            finished = [] if error else [(position, file, result)]
+            for copy_position, copy, copy_stats in copies:
+                self._record_file(copy_stats)
+                if error:
+                    self.skipped_files.append((copy, error))
+                elif complete:
+                    finished.append((copy_position, copy, dedup.result(copy, result)))
+            return finished
+
+        if self.worker_pool is None and self.workers <= 1 and not self.isolate and not self.file_timeout:
+            # In this process, a stop is noticed between rows
+            for position, file, task in pending_files():
+                if not self.searching:
+                    break
+                if progress_callback:
+                    progress_callback(str(file))
+                if isinstance(task, tuple):  # Known without searching
+                    self._record_file(task[0])
+                    yield position, file, task[1]
+                    continue
+                yield from finish(position, file, *self.run_timed(method_name, file, args, task))
+            return
+
+        index_path = self.index.db_path if self.index is not None else None
+        options = self.worker_options()
+        scheduled = queue.Queue(maxsize=SCHEDULED_AHEAD)  # (position, file, task), then None or the exception raised
+        done = threading.Event()
+
+        def schedule():
+            def hand_over(item):
+                while self.searching and not done.is_set():
+                    try:
+                        scheduled.put(item, timeout=0.2)
+                        return True
+                    except queue.Full:
+                        pass
+                return False
+
+            files = pending_files()
+            try:
+                for item in files:
+                    if not hand_over(item):
+                        return
+                hand_over(None)
+            except Exception as e:
+                hand_over(e)
+            finally:
+                files.close()  # Stops the directory walk when the search ended early
+
+        exhausted = False
+        deferred = []  # (position, file) of the files that ran over the time limit, searched again at the end
+        pool = self.worker_pool.lease() if self.worker_pool is not None else WorkerPool(self.workers)
+        try:
+            threading.Thread(target=schedule, daemon=True).start()
+            while self.searching:
+                while pool.has_capacity() and self.searching:
+                    if not exhausted:
+                        try:
+                            # Only wait for the next file while no worker is busy, otherwise collect results first
+                            item = scheduled.get_nowait() if pool.busy else scheduled.get(timeout=0.2)
+                        except queue.Empty:
+                            break
+                        if item is None:
+                            exhausted = True
+                            continue
+                        if isinstance(item, Exception):
+                            raise item
+                        position, file, task = item
+                        if isinstance(task, tuple):  # Known without searching
+                            self._record_file(task[0])
+                            if progress_callback:
+                                progress_callback(str(file))
+                            yield position, file, task[1]
+                            continue
+                        time_limit = self.file_timeout
+                    elif deferred:
+                        position, file = deferred.pop(0)
+                        task, time_limit = False, None
+                    else:
+                        break
+                    pool.submit((position, file, time_limit), (method_name, file, args, index_path, options, task))
+                if not pool.busy:
+                    if exhausted and not deferred:
+                        break
+                    continue
+                # Wake up regularly so a stop request or a time limit is noticed even while all workers are busy
+                for (position, file, _), (result, error, file_stats) in pool.wait(0.2 if exhausted else 0.02):
+                    if file_stats is None:  # The worker died
+                        file_stats = new_file_stats(file)
+                        file_stats.update(status='error', error=error)
+                    if progress_callback:
+                        progress_callback(str(file))
+                    yield from finish(position, file, result, error, file_stats)
+                for key, seconds in pool.running():
+                    position, file, time_limit = key
+                    if time_limit is not None and seconds > time_limit:
+                        pool.cancel(key)
+                        if self.over_budget == 'defer':
+                            deferred.append((position, file))
+                            continue
+                        error = f"Over the time limit of {time_limit} s"
+                        file_stats = new_file_stats(file)
+                        file_stats.update(status='timeout', error=error, seconds=seconds)
+                        yield from finish(position, file, None, error, file_stats)
+        finally:
+            done.set()
+            pool.close()  # When stopped, the files still being parsed are interrupted instead of waited for
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def stop_search(self):
+        """
+        Ask the running search to stop, e.g. from another thread. In worker processes, which are used with more than one
+        worker, a file_timeout, isolate or a worker_pool, the files being searched are interrupted right away. Searching
+        in this process, a stop is only noticed between rows: a file still being opened, like a large .xlsx in
+        openpyxl's load_workbook, is finished opening first, which can take many seconds. Use isolate where that matters.
+        """
+        self.searching = False
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+class ListingRefresher:
+    """
+    Keeps the listing cache of a searcher warm while the application is idle, by walking its base folder every
+    interval seconds in a background thread. Only directories that changed since the last walk are listed again.
+
+    pause() interrupts a walk in progress, e.g. for the duration of a search, and resume() lets the next one run.
+    """
+
+    def __init__(self, searcher, interval=300):
+        if searcher.listing_cache is None:
+            raise ValueError("The searcher has no listing cache to refresh")
+        self.searcher = searcher  # Searcher whose folder, recursion, directory filters and listing cache are used
+        self.interval = interval
+        self._wake = threading.Event()
+        self._paused = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def start(self):
+        self._thread.start()
+        return self
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            if not self._paused:
+                self.refresh()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def refresh(self):
+        """Walk the folder once, updating the listing cache. Returns the number of files found."""
+        searcher = self.searcher
+        searcher.searching = True
+        searcher.skipped_files = []
+        count = 0
+        try:
+            # An empty pattern matches every Excel and CSV file; the cache keeps all names regardless of the pattern
+            for _ in searcher.iter_excel_files('', include_csv=True):
+                if self._paused or self._stopped:  # Paused right as the walk started
+                    break
+                count += 1
+        finally:
+            searcher.searching = False
+        return count
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def pause(self):
+        self._paused = True
+        self.searcher.stop_search()
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def resume(self):
+        self._paused = False
+
+    #-----------------------------------------------------------------------------------------------------------------------------
+    def stop(self):
+        self._stopped = True
+        self.searcher.stop_search()
+        self._wake.set()
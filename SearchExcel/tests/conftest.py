@@ -0,0 +1,113 @@
+"""
+Shared helpers for the tests: the Src folder on the import path and small workbooks generated on the fly.
+"""
+import os
+import re
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Src'))
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def rewrite_xlsx(source, target, edits):
+    """
+    Copy an xlsx package, changing its parts on the way. edits maps a part name to None (drop the part),
+    a new part name (rename it) or a function taking and returning the part's bytes. Other parts are copied as is.
+    """
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for item in zin.infolist():
+            data = zin.read(item.filename)
+            name = item.filename
+            edit = edits.get(name, name)
+            if edit is None:
+                continue
+            if callable(edit):
+                data = edit(data)
+            else:
+                name = edit
+            zout.writestr(name, data)
+    return target
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def replace_bytes(pattern, replacement):
+    """Return an edit for rewrite_xlsx substituting a regular expression in a part."""
+    return lambda data: re.sub(pattern, replacement, data)
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def make_xlsx(tmp_path):
+    """Return a function writing a workbook with the given {cell: value} per sheet title and returning its path."""
+    import openpyxl
+
+    def make(name, sheets):
+        workbook = openpyxl.Workbook()
+        workbook.remove(workbook.active)
+        for title, cells in sheets.items():
+            sheet = workbook.create_sheet(title)
+            for cell, value in cells.items():
+                sheet[cell] = value
+        path = tmp_path / name
+        workbook.save(path)
+        return str(path)
+
+    return make
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def searcher(tmp_path):
+    """Return a searcher over tmp_path, ready for calls on single files."""
+    from excel_searcher import ExcelSearcher
+
+    searcher = ExcelSearcher(str(tmp_path))
+    searcher.searching = True
+    return searcher
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def make_shared_strings_xlsx(tmp_path):
+    """
+    Return a function writing a minimal workbook whose row 1 holds the given texts as shared strings, the way Excel
+    stores text. The shared strings part can be given another name, or left unlinked from the workbook.
+    """
+    def make(name, texts, part='xl/sharedStrings.xml', linked=True):
+        main = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+        rel = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+        strings = ''.join(f'<si><t>{escape(text)}</t></si>' for text in texts)
+        cells = ''.join(f'<c r="{chr(65 + index)}1" t="s"><v>{index}</v></c>' for index in range(len(texts)))
+        shared_strings_rel = f'<Relationship Id="rId2" Type="{rel}/sharedStrings" Target="/{part}"/>' if linked else ''
+        parts = {
+            '[Content_Types].xml':
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                '<Override PartName="/xl/worksheets/sheet1.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                f'<Override PartName="/{part}" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+                '</Types>',
+            '_rels/.rels':
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                f'<Relationship Id="rId1" Type="{rel}/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+            'xl/workbook.xml':
+                f'<workbook xmlns="{main}" xmlns:r="{rel}"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+            'xl/_rels/workbook.xml.rels':
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                f'<Relationship Id="rId1" Type="{rel}/worksheet" Target="worksheets/sheet1.xml"/>{shared_strings_rel}'
+                '</Relationships>',
+            'xl/worksheets/sheet1.xml': f'<worksheet xmlns="{main}"><sheetData><row r="1">{cells}</row></sheetData></worksheet>',
+            part: f'<sst xmlns="{main}" count="{len(texts)}" uniqueCount="{len(texts)}">{strings}</sst>',
+        }
+        path = tmp_path / name
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for part_name, xml in parts.items():
+                archive.writestr(part_name, xml)
+        return str(path)
+
+    return make
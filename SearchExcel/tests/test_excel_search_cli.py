@@ -0,0 +1,29 @@
+"""
+Tests of the command line front end: exit codes and output when things go wrong.
+"""
+import os
+import subprocess
+import sys
+
+from excel_search_cli import main
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Src', 'excel_search_cli.py')
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_invalid_regex_is_reported(tmp_path, capsys):
+    assert main([str(tmp_path), '[', '--regex']) == 2
+    assert capsys.readouterr().err.startswith("Invalid search text: ")
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_closed_pipe_ends_quietly(tmp_path):
+    os.makedirs(tmp_path / 'data')
+    (tmp_path / 'data' / 'rows.csv').write_text(''.join(f'{row};PN-42 in row {row}\n' for row in range(20000)))
+    process = subprocess.Popen([sys.executable, CLI, str(tmp_path), 'pn-42', '--csv', '--all-rows'],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.stdout.readline().strip().endswith(b'rows.csv')
+    process.stdout.close()  # Like head after its first line
+    stderr = process.stderr.read()
+    process.stderr.close()
+    assert process.wait(timeout=60) == 141
+    assert b'Traceback' not in stderr
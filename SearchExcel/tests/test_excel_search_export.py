@@ -0,0 +1,32 @@
+"""
+Tests of the streaming exports: what is on disk while a search is still running.
+"""
+import json
+
+import pytest
+
+from excel_search_export import open_exporter
+from excel_searcher import SearchMatch
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('name', ['results.csv', 'results.jsonl', 'results.txt'])
+def test_written_match_is_on_disk_before_close(tmp_path, name):
+    path = tmp_path / name
+    with open_exporter(str(path)) as exporter:
+        exporter.write(SearchMatch('book.xlsx', 'Data', 3, ['PN-42', 7]))
+        assert 'PN-42' in path.read_text(encoding='utf-8')
+    assert 'PN-42' in path.read_text(encoding='utf-8')
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_xlsx_journal_is_on_disk_before_close(tmp_path):
+    import openpyxl
+
+    path = tmp_path / 'results.xlsx'
+    journal = tmp_path / 'results.xlsx.partial.jsonl'
+    with open_exporter(str(path)) as exporter:
+        exporter.write(SearchMatch('book.xlsx', 'Data', 3, ['PN-42', 7]))
+        assert json.loads(journal.read_text(encoding='utf-8'))['row'] == ['PN-42', 7]
+    assert not journal.exists()
+    rows = list(openpyxl.load_workbook(path).active.values)
+    assert rows[1] == ('book.xlsx', 'Data', 3, 'PN-42', 7)
@@ -0,0 +1,57 @@
+"""
+Tests of the search server: requests it has to refuse before a search starts.
+"""
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from excel_search_server import SearchServer
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.fixture
+def server():
+    server = SearchServer(('127.0.0.1', 0), workers=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def post_search(server, search):
+    request = urllib.request.Request(f'http://127.0.0.1:{server.server_address[1]}/search', data=json.dumps(search).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('option, value', [
+    ('workers', 2), ('file_timeout', 'x'), ('file_timeout', 0), ('max_file_size', True), ('max_depth', 1.5),
+    ('max_depth', -1), ('recursive', 'yes'), ('include_dirs', 'data'), ('exclude_dirs', [1]), ('csv_encoding', 'no-such-codec'),
+    ('csv_delimiter', ';;'), ('order', 'name'), ('over_budget', None), ('terms', {'a': 1}), ('fname_match', 3),
+])
+def test_invalid_options_are_refused(server, tmp_path, option, value):
+    status, reply = post_search(server, {'path': str(tmp_path), 'terms': 'pn-42', option: value})
+    assert status == 400
+    assert option in reply['error']
+    assert server.served == 0 and server.running == 0
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_valid_options_are_accepted(server, tmp_path):
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'rows.csv').write_text('1;PN-42\n')
+    status, body = post_search(server, {'path': str(tmp_path), 'terms': ['pn-42'], 'include_csv': True, 'recursive': True,
+                                        'max_depth': 2, 'exclude_dirs': ['.git'], 'csv_encoding': 'utf-8', 'csv_delimiter': ';',
+                                        'order': 'size', 'max_file_size': 1e6, 'file_timeout': 30, 'over_budget': 'skip'})
+    events = [json.loads(line) for line in body.splitlines()]
+    assert status == 200
+    assert [event['file'] for event in events if event['event'] == 'match'] == [str(tmp_path / 'data' / 'rows.csv')]
+    assert events[-1]['event'] == 'done'
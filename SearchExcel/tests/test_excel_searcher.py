@@ -0,0 +1,312 @@
+"""
+Regression tests for ExcelSearcher: matches that the fast paths (read-only parsing, pre-filters, byte-level CSV
+search, deduplication and caches) must not lose compared to parsing every file completely.
+"""
+import codecs
+import datetime
+import os
+import shutil
+import threading
+
+import pytest
+
+from conftest import replace_bytes, rewrite_xlsx
+import excel_searcher
+from excel_searcher import ContentIndex, ExcelSearcher, ListingCache, ResultCache, SearchQuery, _Deduplicator, content_hash, xlsx_may_contain
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_stale_dimension_does_not_hide_rows(make_xlsx, searcher, tmp_path):
+    source = make_xlsx('source.xlsx', {'Data': {'A1': 'head', 'F25': 'secret PN-42'}})
+    stale = rewrite_xlsx(source, str(tmp_path / 'stale.xlsx'), {
+        'xl/worksheets/sheet1.xml': replace_bytes(rb'<dimension ref="[^"]*" ?/>', b'<dimension ref="A1:B10"/>'),
+    })
+    for prefilter in (True, False):
+        searcher.prefilter = prefilter
+        assert searcher.search_excel(stale, 'pn-42') == [[None, None, None, None, None, 'secret PN-42']]
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_stale_dimension_is_indexed(make_xlsx, tmp_path):
+    source = make_xlsx('source.xlsx', {'Data': {'A1': 'head', 'F25': 'secret PN-42'}})
+    stale = rewrite_xlsx(source, str(tmp_path / 'stale.xlsx'), {
+        'xl/worksheets/sheet1.xml': replace_bytes(rb'<dimension ref="[^"]*" ?/>', b'<dimension ref="A1:B10"/>'),
+    })
+    os.remove(source)
+    index = ContentIndex(str(tmp_path / 'index.db'))
+    try:
+        searcher = ExcelSearcher(str(tmp_path), index=index)
+        searcher.searching = True
+        assert searcher.search_excel(stale, 'pn-42') == [[None, None, None, None, None, 'secret PN-42']]
+        assert index.lookup(stale, SearchQuery('pn-42'))[0].row_number == 25
+    finally:
+        index.close()
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_index_keeps_value_types_as_json(make_xlsx, tmp_path):
+    when = datetime.datetime(2024, 2, 29, 13, 45, 10)
+    path = make_xlsx('typed.xlsx', {'Data': {'A1': 'PN-42', 'B1': 7, 'C1': 2.5, 'D1': True, 'E1': when}})
+    index = ContentIndex(str(tmp_path / 'index.db'))
+    try:
+        searcher = ExcelSearcher(str(tmp_path), index=index)
+        searcher.searching = True
+        expected = [['PN-42', 7, 2.5, True, when]]
+        assert searcher.search_excel(path, 'pn-42') == expected  # Parsed and indexed
+        assert searcher.search_excel(path, 'pn-42') == expected  # Answered from the index
+        vals, = index.conn.execute("SELECT vals FROM rows").fetchone()
+        assert isinstance(vals, str) and '"datetime"' in vals
+    finally:
+        index.close()
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_index_is_written_in_batches_and_complete_only_at_the_end(make_xlsx, tmp_path, monkeypatch):
+    monkeypatch.setattr(excel_searcher, 'INDEX_BATCH_ROWS', 2)
+    path = make_xlsx('rows.xlsx', {'Data': {f'A{row}': f'PN-42 #{row}' for row in range(1, 8)}})
+    index = ContentIndex(str(tmp_path / 'index.db'))
+    try:
+        searcher = ExcelSearcher(str(tmp_path), index=index)
+        searcher.searching = True
+        iter_rows = searcher.iter_rows
+
+        def stop_after_five_rows(*args, **kwargs):
+            for record in iter_rows(*args, **kwargs):
+                yield record
+                if record[1] == 5:
+                    searcher.stop_search()
+
+        searcher.iter_rows = stop_after_five_rows
+        assert searcher.find_matches(path, SearchQuery('pn-42', all_rows=True)) == []
+        assert index.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0] == 4  # Two batches written
+        assert not index.is_fresh(path)
+
+        searcher.iter_rows = iter_rows
+        searcher.searching = True
+        assert len(searcher.find_matches(path, SearchQuery('pn-42', all_rows=True))) == 7
+        assert index.is_fresh(path)
+        assert len(index.lookup(path, SearchQuery('pn-42', all_rows=True))) == 7
+    finally:
+        index.close()
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_index_candidates_follow_writes_of_other_connections(tmp_path):
+    paths = {}
+    for name in ('a', 'b', 'c'):
+        paths[name] = tmp_path / f'{name}.csv'
+        paths[name].write_text(name)
+    writer = ContentIndex(str(tmp_path / 'index.db'))
+    reader = ContentIndex(str(tmp_path / 'index.db'))  # Like a worker process searching while another one indexes
+    try:
+        if not reader.has_fts:
+            pytest.skip("SQLite without the FTS5 trigram tokenizer")
+        query = SearchQuery('pn-42')
+        writer.store(str(paths['a']), [(None, 1, ['PN-42 in a'])])
+        assert len(reader.lookup(str(paths['a']), query)) == 1
+        searched_row = reader._candidates[1]
+
+        writer.store(str(paths['b']), [(None, 1, ['PN-42 in b'])])
+        writer.store(str(paths['c']), [(None, 1, ['nothing'])])
+        assert len(reader.lookup(str(paths['b']), query)) == 1
+        assert reader.lookup(str(paths['c']), query) == []
+        assert reader._candidates[1] > searched_row  # Only the new rows were searched
+
+        writer.store(str(paths['a']), [(None, 1, ['no longer'])])  # Replaced content
+        assert reader.lookup(str(paths['a']), query) == []
+        writer.store(str(paths['c']), [(None, 1, ['now PN-42'])])
+        assert len(reader.lookup(str(paths['c']), query)) == 1
+    finally:
+        writer.close()
+        reader.close()
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_databases_default_to_a_per_user_folder(tmp_path, monkeypatch):
+    monkeypatch.delenv('LOCALAPPDATA', raising=False)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    index = ContentIndex()
+    try:
+        assert index.db_path == str(tmp_path / 'cache' / 'excel_search' / 'excel_search_index.db')
+    finally:
+        index.close()
+    if os.name == 'posix':
+        assert os.stat(tmp_path / 'cache' / 'excel_search').st_mode & 0o077 == 0
+
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_prefilter_reads_shared_strings(make_shared_strings_xlsx, searcher):
+    path = make_shared_strings_xlsx('shared.xlsx', ['a', 'PN-42 here'])
+    assert xlsx_may_contain(path, ['pn-42'])
+    assert not xlsx_may_contain(path, ['absent'])
+    assert searcher.search_excel(path, 'pn-42') == [['a', 'PN-42 here']]
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_prefilter_finds_shared_strings_part_with_another_name(make_shared_strings_xlsx, searcher):
+    path = make_shared_strings_xlsx('renamed.xlsx', ['a', 'PN-42 here'], part='xl/SharedStrings.xml')
+    assert xlsx_may_contain(path, ['pn-42'])
+    assert searcher.search_excel(path, 'pn-42') == [['a', 'PN-42 here']]
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_prefilter_keeps_files_with_unreadable_shared_strings(make_shared_strings_xlsx):
+    path = make_shared_strings_xlsx('unlinked.xlsx', ['a', 'PN-42 here'], linked=False)
+    assert xlsx_may_contain(path, ['pn-42'])
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_prefilter_rejects_files_without_the_text(make_xlsx):
+    path = make_xlsx('other.xlsx', {'Data': {'A1': 'nothing', 'B2': 'to see'}})
+    assert not xlsx_may_contain(path, ['pn-42'])
+    assert xlsx_may_contain(path, ['see'])
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('encoding, bom, parser', [('utf-8', b'', 'csv-bytes'), ('utf-8', codecs.BOM_UTF8, 'csv-bytes'),
+                                                  ('cp1252', b'', 'csv-bytes'), ('utf-16', b'', 'csv')])
+def test_csv_byte_search_matches_row_parser(tmp_path, encoding, bom, parser):
+    text = 'id;name;remark\n1;Æble;nothing\n2;widget;PN-42 inside\n3;gadget;pn-42 again\n'
+    path = tmp_path / 'data.csv'
+    path.write_bytes(bom + text.encode(encoding))
+    results = {}
+    for prefilter in (True, False):
+        searcher = ExcelSearcher(str(tmp_path), prefilter=prefilter, csv_encoding=None)
+        searcher.searching = True
+        results[prefilter] = searcher.find_matches(str(path), SearchQuery('pn-42', all_rows=True))
+        if prefilter:
+            assert searcher.file_stats['parser'] == parser
+    assert results[True] == results[False]
+    assert [match.row_number for match in results[True]] == [3, 4]
+    assert results[True][0].row == ['2', 'widget', 'PN-42 inside']
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('data', [b'id;part\r1;PN-42\r2;other\r', b'id;part\r\nx\ry;z\r\n1;PN-42\r\n'])
+def test_csv_byte_search_handles_lone_carriage_returns(tmp_path, data):
+    path = tmp_path / 'mac.csv'
+    path.write_bytes(data)
+    results = {}
+    for prefilter in (True, False):
+        searcher = ExcelSearcher(str(tmp_path), prefilter=prefilter)
+        searcher.searching = True
+        results[prefilter] = searcher.find_matches(str(path), 'pn-42')
+    assert results[True] == results[False]
+    assert [match.row for match in results[True]] == [['1', 'PN-42']]
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('needle', ['pn-42', 'æble'])
+def test_csv_dialect_is_detected_once(tmp_path, needle):
+    path = tmp_path / 'data.csv'
+    path.write_text('id;name\n1;Æble\n2;PN-42 "quoted"\n', encoding='cp1252')
+    searcher = ExcelSearcher(str(tmp_path), csv_encoding=None)
+    searcher.searching = True
+    csv_dialect = searcher.csv_dialect
+    calls = []
+    searcher.csv_dialect = lambda file_path: calls.append(file_path) or csv_dialect(file_path)
+    assert len(searcher.find_matches(str(path), needle)) == 1  # The quotes send both needles to the row parser
+    assert len(calls) == 1
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_deduplicated_search_matches_separate_searches(make_xlsx, tmp_path):
+    original = make_xlsx('original.xlsx', {'Data': {'A1': 'x', 'B3': 'PN-42'}})
+    os.makedirs(tmp_path / 'copies')
+    for index in range(3):
+        shutil.copy(original, tmp_path / 'copies' / f'copy{index}.xlsx')
+    make_xlsx('different.xlsx', {'Data': {'A1': 'PN-42 too'}})
+    results = {}
+    for dedupe in (True, False):
+        searcher = ExcelSearcher(str(tmp_path), recursive=True, dedupe=dedupe, result_cache=ResultCache() if dedupe else None)
+        results[dedupe] = sorted(searcher.iter_matches('', 'pn-42'))
+    assert results[True] == results[False]
+    assert len(results[True]) == 5
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_stopped_search_is_not_cached(make_xlsx, tmp_path):
+    make_xlsx('rows.xlsx', {'Data': {f'A{row}': f'PN-42 #{row}' for row in range(1, 6)}})
+    cache = ResultCache()
+    query = SearchQuery('pn-42', all_rows=True)
+    searcher = ExcelSearcher(str(tmp_path), recursive=True, result_cache=cache)
+    iter_rows = searcher.iter_rows
+
+    def stop_after_first_row(*args, **kwargs):
+        for record in iter_rows(*args, **kwargs):
+            yield record
+            searcher.stop_search()
+
+    searcher.iter_rows = stop_after_first_row
+    assert len(list(searcher.iter_matches('', query))) == 1
+    assert searcher.stats.counters()['stopped'] == 1
+
+    searcher = ExcelSearcher(str(tmp_path), recursive=True, result_cache=cache)
+    assert len(list(searcher.iter_matches('', query))) == 5
+    assert searcher.stats.counters()['searched'] == 1
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_hashing_stops_with_the_search(tmp_path):
+    paths = [tmp_path / 'a.bin', tmp_path / 'b.bin']
+    for path in paths:
+        path.write_bytes(b'x' * 100)
+    checks = []
+
+    def running():
+        checks.append(True)
+        return len(checks) < 3
+
+    assert content_hash(paths[0], chunk_size=10, running=running) is None
+    assert len(checks) == 3
+    assert content_hash(paths[0]) == content_hash(paths[1])
+
+    searching = [True]
+    dedup = _Deduplicator('key', running=lambda: searching[0])
+    assert dedup.admit(0, str(paths[0]))[0] == 'search'
+    searching[0] = False  # The second file of that size makes both be hashed, which is cut short
+    action, file_stats = dedup.admit(1, str(paths[1]))
+    assert action == 'search' and file_stats['digest'] is None
+    assert not dedup.digests and not dedup.contents
+
+#-----------------------------------------------------------------------------------------------------------------------------
+def test_results_are_collected_while_the_walk_blocks(make_xlsx, tmp_path):
+    first = make_xlsx('first.xlsx', {'Data': {'A1': 'PN-42'}})
+    second = make_xlsx('second.xlsx', {'Data': {'A1': 'PN-42 as well'}})
+    collected = threading.Event()
+    waited = []
+
+    def slow_walk():
+        yield first
+        waited.append(collected.wait(20))  # Like a folder that takes long to list on a network share
+        yield second
+
+    searcher = ExcelSearcher(str(tmp_path), workers=2)
+    searcher.searching = True
+    found = []
+    for _, file, matches in searcher._map_files(slow_walk(), 'find_matches', (SearchQuery('pn-42'),)):
+        found.append(file)
+        collected.set()
+    assert waited == [True]
+    assert sorted(found) == [first, second]
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.skipif(os.name == 'nt', reason="No peak RSS on Windows")
+def test_workers_report_their_own_peak_rss(make_xlsx, tmp_path):
+    make_xlsx('first.xlsx', {'Data': {'A1': 'PN-42'}})
+    searcher = ExcelSearcher(str(tmp_path), recursive=True, workers=2)
+    assert len(list(searcher.iter_matches('', 'pn-42'))) == 1
+    file_stats, = searcher.stats.files
+    assert file_stats['pid'] not in (None, os.getpid())
+    assert file_stats['peak_rss'] > 0
+
+#-----------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('dedupe', [False, True])
+def test_unchanged_tree_is_listed_from_the_cache(make_xlsx, tmp_path, monkeypatch, dedupe):
+    os.makedirs(tmp_path / 'tree' / 'data')
+    for index in range(3):
+        make_xlsx(os.path.join('tree', 'data', f'book{index}.xlsx'), {'Data': {'A1': f'PN-42 #{index}'}})
+    listing_cache = ListingCache(str(tmp_path / 'listings.db'))  # Outside the tree, saving it would change its mtime
+    searcher = ExcelSearcher(str(tmp_path / 'tree'), recursive=True, dedupe=dedupe, listing_cache=listing_cache)
+    assert len(list(searcher.iter_matches('', 'pn-42'))) == 3  # Fills the cache
+
+    stat = os.stat
+    stated = []
+
+    def counting_stat(path, *args, **kwargs):
+        if str(path).endswith('.xlsx') and threading.current_thread().name.startswith('ThreadPoolExecutor'):
+            stated.append(path)  # By the listing threads
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'stat', counting_stat)
+    hits, misses = listing_cache.hits, listing_cache.misses
+    assert len(list(searcher.iter_matches('', 'pn-42'))) == 3
+    # The unchanged tree is answered from the cache, whether or not the files are deduplicated
+    assert listing_cache.hits > hits and listing_cache.misses == misses
+    assert not stated  # Deduplication stats the files itself, when it needs them